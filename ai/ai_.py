@@ -1,417 +1,988 @@
 import torch
-from transformers import GPT2LMHeadModel, GPT2Tokenizer
+from transformers import GPT2LMHeadModel, GPT2Tokenizer, TextIteratorStreamer, set_seed
+from transformers.pytorch_utils import Conv1D
 import spacy
+import asyncio
 import random
+import io
+import json
+import hashlib
+import re
+import sys
+import threading
+import time
+
+from batcher import MicroBatcher
+from cache import cache_key
+from metrics import NULL_STAGE, StageTimer
+from postprocess import SENTENCE_BOUNDARY, PostProcessor
+
+# Topic-specific personal comments, keyed by the lemma that triggers them
+TOPIC_COMMENTS = {
+    'technology': (
+        "As a tech enthusiast, I find this development fascinating.",
+        "This reminds me of my own experiences with new gadgets.",
+        "Technology is evolving so quickly; it's hard to keep up!",
+        "I'm always excited about new tech trends.",
+        "This is a breakthrough in the tech industry.",
+        "Technology is constantly advancing.",
+        "I believe that technology has the power to improve our lives.",
+        "I'm always intrigued by new tech innovations.",
+        "Technology is shaping the future in unimaginable ways.",
+        "The tech industry is full of opportunities.",
+        "Technology is constantly evolving.",
+        "I believe that technology can change the world.",
+        "I'm fascinated by technological advancements.",
+        "Technology is integral to modern life.",
+        "The tech industry is full of innovation."
+    ),
+    'science': (
+        "From my perspective, scientific discoveries always bring excitement.",
+        "I believe that science has the potential to solve many of our problems.",
+        "Science constantly amazes me with new findings.",
+        "I'm fascinated by how science can explain so much about our world.",
+        "Scientific research is the key to our future.",
+        "Science is a never-ending journey of discovery.",
+        "I believe that scientific research is crucial for progress.",
+        "I'm fascinated by the mysteries of the universe.",
+        "Science can explain so many phenomena in our world.",
+        "The field of science is always evolving.",
+        "Science is a path to understanding.",
+        "I believe that science can solve many problems.",
+        "I'm always interested in scientific discoveries.",
+        "Science explains the workings of the universe.",
+        "The field of science is ever-growing."
+    ),
+    'history': (
+        "As a history buff, I find this period particularly interesting.",
+        "This event had a significant impact on the course of history.",
+        "History teaches us so much about our present.",
+        "I'm always intrigued by historical events like this.",
+        "Studying history gives us insight into our future.",
+        "History is a window into the past.",
+        "I believe that understanding history is essential for our future.",
+        "I'm always learning new things about historical events.",
+        "History helps us understand our present.",
+        "The study of history is full of fascinating stories.",
+        "History teaches us about our past.",
+        "I believe that history is crucial for understanding the present.",
+        "I'm always learning from historical events.",
+        "History shapes our identity.",
+        "The study of history is enlightening."
+    ),
+    'health': (
+        "Health is a topic close to my heart.",
+        "In my opinion, maintaining good health should be a priority for everyone.",
+        "I'm always looking for new ways to stay healthy.",
+        "Health trends are constantly changing, it's important to stay informed.",
+        "A healthy lifestyle is essential for a happy life.",
+        "Health is wealth.",
+        "I believe that taking care of our health is paramount.",
+        "I'm always seeking ways to improve my wellbeing.",
+        "Health is a lifelong journey.",
+        "The field of health and wellness is constantly evolving.",
+        "Health is the foundation of life.",
+        "I believe in prioritizing health above all.",
+        "I'm always learning about health and wellness.",
+        "Health is a continuous journey.",
+        "The health field is dynamic and evolving."
+    ),
+    'education': (
+        "Education is the foundation of a successful society.",
+        "I believe that everyone deserves access to quality education.",
+        "Education opens so many doors in life.",
+        "I'm passionate about lifelong learning.",
+        "The education system needs constant improvement.",
+        "Education is the key to success.",
+        "I believe that learning is a lifelong process.",
+        "I'm passionate about the value of education.",
+        "Education empowers individuals and communities.",
+        "The education system needs continuous improvement.",
+        "Education is the key to opportunity.",
+        "I believe in the power of education.",
+        "Education transforms lives.",
+        "The education system is essential for progress."
+    ),
+    'environment': (
+        "Protecting the environment is crucial for our future.",
+        "I believe that environmental conservation should be a priority.",
+        "I'm always looking for ways to reduce my environmental footprint.",
+        "Environmental issues are becoming more urgent every day.",
+        "Sustainable practices are essential for the health of our planet.",
+        "The environment is our shared responsibility.",
+        "I believe that we must take action to protect our planet.",
+        "I'm always looking for ways to be more eco-friendly.",
+        "Environmental conservation is crucial for our future.",
+        "The state of the environment affects us all.",
+        "The environment is our collective responsibility.",
+        "I believe in taking action to protect the environment.",
+        "I'm committed to sustainable living.",
+        "Environmental conservation is vital.",
+        "The state of the environment impacts everyone."
+    ),
+    'economy': (
+        "The economy affects every aspect of our lives.",
+        "I believe that economic stability is crucial for a thriving society.",
+        "Economic trends are fascinating to study.",
+        "I'm always interested in learning more about economic policies.",
+        "The global economy is constantly changing.",
+        "The economy is a complex system.",
+        "I believe that understanding economics is important for everyone.",
+        "I'm always interested in economic trends and policies.",
+        "Economic stability is crucial for a prosperous society.",
+        "The global economy is interconnected.",
+        "The economy is the backbone of society.",
+        "I believe in understanding economic principles.",
+        "I'm always interested in economic developments.",
+        "Economic health is crucial for a thriving society.",
+        "The global economy is complex and interconnected."
+    ),
+    'politics': (
+        "Politics play a huge role in shaping our society.",
+        "I believe that everyone should stay informed about political issues.",
+        "Political decisions have far-reaching consequences.",
+        "I'm always interested in discussing political topics.",
+        "The political landscape is constantly evolving.",
+        "Politics influence every aspect of our lives.",
+        "I believe that political engagement is crucial for democracy.",
+        "I'm always keeping up with political news.",
+        "Political decisions have wide-ranging impacts.",
+        "The political landscape is always changing.",
+        "Politics shape our world.",
+        "I believe in staying informed about political issues.",
+        "I'm engaged in political discussions.",
+        "Political decisions have significant consequences.",
+        "The political climate is constantly shifting."
+    ),
+    'art': (
+        "Art is a powerful form of expression.",
+        "I believe that art has the ability to change the world.",
+        "I'm always inspired by the creativity of artists.",
+        "Art can convey complex emotions and ideas.",
+        "The art world is full of fascinating people and stories.",
+        "Art is a reflection of society.",
+        "I believe that art can inspire change.",
+        "I'm always exploring different art forms.",
+        "Art allows us to see the world from different perspectives.",
+        "The world of art is full of creativity.",
+        "Art reflects culture.",
+        "I'm passionate about exploring art.",
+        "Art provides new perspectives.",
+        "The art world is diverse and dynamic."
+    ),
+    'literature': (
+        "Literature opens up new worlds and perspectives.",
+        "I believe that reading is essential for personal growth.",
+        "I'm always looking for new books to read.",
+        "Literature can teach us so much about the human experience.",
+        "The literary world is full of diverse voices and stories.",
+        "Literature opens up new worlds.",
+        "I believe that reading broadens the mind.",
+        "I'm always on the lookout for new books.",
+        "Literature can teach us about different cultures and experiences.",
+        "The literary world is rich with stories.",
+        "Literature expands our horizons.",
+        "I believe in the transformative power of literature.",
+        "I'm always reading new books.",
+        "Literature connects us to different experiences.",
+        "The literary world is vast and varied."
+    ),
+    'travel': (
+        "Traveling is one of the best ways to learn about the world.",
+        "I believe that travel broadens the mind.",
+        "I'm always planning my next adventure.",
+        "Travel experiences create lifelong memories.",
+        "Exploring new places is always exciting.",
+        "Travel broadens the horizons.",
+        "I believe that travel is an essential part of life.",
+        "I'm always planning my next trip.",
+        "Travel experiences create unforgettable memories.",
+        "Travel enriches the soul.",
+        "I believe in the value of travel.",
+        "I'm constantly planning my next trip.",
+        "Travel experiences are invaluable.",
+        "Exploring new places is a passion."
+    ),
+    'food': (
+        "Food is a universal language that brings people together.",
+        "I believe that trying new foods is an adventure.",
+        "I'm always on the lookout for new recipes.",
+        "Food has a unique way of connecting cultures.",
+        "Exploring different cuisines is one of my favorite pastimes.",
+        "Food is a cultural experience.",
+        "I'm always excited to try new recipes.",
+        "Food brings people together.",
+        "Exploring different cuisines is one of my passions.",
+        "Food is a journey of discovery.",
+        "I believe in the joy of trying new foods.",
+        "I'm always experimenting with new recipes.",
+        "Exploring cuisines is a delightful experience."
+    ),
+    'sports': (
+        "Sports have the power to unite people.",
+        "I believe that physical activity is crucial for a healthy life.",
+        "I'm always excited to watch my favorite teams play.",
+        "Sports teach valuable lessons about teamwork and perseverance.",
+        "The world of sports is always full of excitement.",
+        "Sports bring people together.",
+        "I believe that physical activity is crucial for health.",
+        "I'm always excited to watch sporting events.",
+        "Sports teach valuable life lessons.",
+        "The world of sports is full of excitement.",
+        "Sports foster unity.",
+        "I believe in the importance of physical activity.",
+        "I'm enthusiastic about watching sports.",
+        "Sports teach perseverance and teamwork.",
+        "The sports world is thrilling."
+    ),
+    'music': (
+        "Music is a universal language.",
+        "I believe that music has the power to heal.",
+        "I'm always discovering new artists and genres.",
+        "Music can convey emotions that words cannot.",
+        "The music industry is constantly evolving.",
+        "I'm always discovering new music.",
+        "Music can express emotions that words cannot.",
+        "The music industry is ever-changing.",
+        "Music transcends boundaries.",
+        "I believe in the healing power of music.",
+        "I'm always exploring new music genres.",
+        "Music communicates emotions beautifully.",
+        "The music industry is ever-evolving."
+    ),
+    'fashion': (
+        "Fashion is a form of self-expression.",
+        "I believe that everyone should find their own style.",
+        "I'm always excited to see new fashion trends.",
+        "Fashion is about more than just clothes; it's about identity.",
+        "The fashion industry is full of creativity.",
+        "I believe that fashion reflects individuality.",
+        "I'm always keeping up with fashion trends.",
+        "Fashion is about more than just clothes.",
+        "The fashion industry is innovative.",
+        "Fashion expresses individuality.",
+        "I believe in the creativity of fashion.",
+        "Fashion is a form of art.",
+        "The fashion industry is innovative and exciting."
+    )
+}
+
+
+def load_comment_bank(path):
+    # Load a custom comment bank from a JSON file mapping topic lemmas to lists of comments
+    with open(path, encoding='utf-8') as f:
+        bank = json.load(f)
+    return {topic: tuple(comments) for topic, comments in bank.items()}
+
+
+def load_spacy(name='en_core_web_sm'):
+    # Topic detection only reads lemmas, so the parser and NER are never needed
+    nlp = spacy.load(name, exclude=['parser', 'ner'])
+    # Without the parser, sentence boundaries come from the (much lighter) senter
+    if 'senter' in nlp.disabled:
+        nlp.enable_pipe('senter')
+    return nlp
+
+
+def topic_forms(nlp, topics):
+    # Lowercase words the pipeline's lemmatizer can map onto one of `topics`: the topics
+    # themselves, forms its suffix rules reduce to them ('histories' -> 'history') and its
+    # exceptions ('people' -> 'person'). None if the lemmatizer's tables can't tell.
+    lemmatizers = [pipe for _, pipe in nlp.pipeline if isinstance(pipe, spacy.pipeline.Lemmatizer)]
+    if len(lemmatizers) != 1:
+        return None
+    lemmatizer = lemmatizers[0]
+    forms = {topic.lower() for topic in topics}
+
+    if lemmatizer.mode == 'lookup':
+        # Lookup tables are keyed by string hash, so words come back through the vocab
+        strings = nlp.vocab.strings
+        for key, lemmas in lemmatizer.lookups.get_table('lemma_lookup', {}).items():
+            lemmas = [lemmas] if isinstance(lemmas, str) else lemmas
+            if any(lemma in topics for lemma in lemmas):
+                if key not in strings:
+                    return None
+                forms.add(strings[key].lower())
+        return forms
+
+    if lemmatizer.mode != 'rule':
+        return None
+    for rules in lemmatizer.lookups.get_table('lemma_rules', {}).values():
+        for old, new in rules:
+            for topic in topics:
+                if topic.endswith(new) and len(topic) > len(new):
+                    forms.add(topic[:len(topic) - len(new)].lower() + old)
+    for exceptions in lemmatizer.lookups.get_table('lemma_exc', {}).values():
+        for word, lemmas in exceptions.items():
+            if any(lemma in topics for lemma in lemmas):
+                forms.add(word.lower())
+    return forms
+
+
+PRECISIONS = ('fp32', 'bf16', 'int8')
+
+
+def cpu_supports_bf16():
+    # Without AVX512-BF16 or AMX, bf16 matmuls are emulated and slower than fp32
+    checks = ('_is_avx512_bf16_supported', '_is_amx_tile_supported')
+    return any(getattr(torch.cpu, check, lambda: False)() for check in checks)
+
+
+def quantize_int8(model):
+    # Dynamic quantization only handles nn.Linear, but GPT-2's attention and MLP layers
+    # are transformers Conv1D (a Linear with a transposed weight), so convert them first
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, Conv1D):
+                linear = torch.nn.Linear(child.weight.shape[0], child.nf)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(module, name, linear)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class ModelRegistry:
+    # Process-wide cache of loaded components, shared by every AIHumanizer instance.
+    # Each component is loaded on first use and its load time is recorded.
+    def __init__(self):
+        self._components = {}
+        self._lock = threading.RLock()
+        self.load_times = {}
+
+    def get(self, key, loader):
+        with self._lock:
+            if key not in self._components:
+                start = time.perf_counter()
+                self._components[key] = loader()
+                self.load_times[key] = time.perf_counter() - start
+            return self._components[key]
+
+    def tokenizer(self, model_name):
+        return self.get(('tokenizer', model_name), lambda: self._load_tokenizer(model_name))
+
+    def model(self, model_name, device, precision='fp32'):
+        return self.get(
+            ('model', model_name, device, precision),
+            lambda: self._load_model(model_name, device, precision)
+        )
+
+    def nlp(self, name='en_core_web_sm'):
+        return self.get(('spacy', name), lambda: load_spacy(name))
+
+    def clear(self):
+        with self._lock:
+            self._components.clear()
+            self.load_times.clear()
+
+    def _load_tokenizer(self, model_name):
+        tokenizer = GPT2Tokenizer.from_pretrained(model_name)
+        # GPT-2 has no pad token; reuse eos, which is already in the vocabulary
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        # Pad on the left so batched prompts all end right where generation starts
+        tokenizer.padding_side = 'left'
+        return tokenizer
+
+    def _load_model(self, model_name, device, precision):
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+        if precision == 'int8' and device != 'cpu':
+            raise ValueError("int8 dynamic quantization is only available on CPU")
+        if precision == 'bf16' and device == 'cpu' and not cpu_supports_bf16():
+            raise ValueError("this CPU has no native bfloat16 support (AVX512-BF16 or AMX)")
+
+        model = GPT2LMHeadModel.from_pretrained(model_name)
+        # Only resize when the tokenizer really grew past the embedding matrix
+        vocab_size = len(self.tokenizer(model_name))
+        if vocab_size > model.get_input_embeddings().num_embeddings:
+            model.resize_token_embeddings(vocab_size)
+        model.to(device)
+        model.eval()
+        if precision == 'bf16':
+            model.to(torch.bfloat16)
+        elif precision == 'int8':
+            model = quantize_int8(model)
+        return model
+
+
+MODEL_REGISTRY = ModelRegistry()
+
+
+class TimedStreamer(TextIteratorStreamer):
+    # Records when each generated token arrives; the first put() is the prompt
+    def __init__(self, tokenizer, **decode_kwargs):
+        super().__init__(tokenizer, **decode_kwargs)
+        self.started = time.perf_counter()
+        self.token_times = []
+        self._prompt_done = False
+
+    def put(self, value):
+        if self._prompt_done:
+            # Assisted generation can accept several tokens in one step
+            self.token_times.extend([time.perf_counter()] * value.numel())
+        self._prompt_done = True
+        super().put(value)
+
+    def stats(self):
+        times = [self.started] + self.token_times
+        inter_token_latencies = [b - a for a, b in zip(times[1:], times[2:])]
+        return {
+            'tokens': len(self.token_times),
+            'time_to_first_token': times[1] - times[0] if self.token_times else None,
+            'inter_token_latencies': inter_token_latencies,
+            'mean_inter_token_latency': (
+                sum(inter_token_latencies) / len(inter_token_latencies) if inter_token_latencies else None
+            ),
+            'total_time': times[-1] - times[0]
+        }
+
 
 class AIHumanizer:
-    def __init__(self, model_name='gpt2-medium'):
-        self.tokenizer = GPT2Tokenizer.from_pretrained(model_name)
-        self.model = GPT2LMHeadModel.from_pretrained(model_name)
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.model.to(self.device)
-        self.nlp = spacy.load('en_core_web_sm')
-        
-        # Add pad token if not present
-        if self.tokenizer.pad_token is None:
-            self.tokenizer.add_special_tokens({'pad_token': self.tokenizer.eos_token})
-            self.model.resize_token_embeddings(len(self.tokenizer))
-
-    def humanize_text(self, ai_text, max_length=150):
-        inputs = self.tokenizer(ai_text, return_tensors='pt', padding=True).to(self.device)
-        output = self.model.generate(
-            inputs['input_ids'],
-            attention_mask=inputs['attention_mask'],
+    def __init__(self, model_name='gpt2-medium', comment_bank=None, device=None, registry=None,
+                 precision='fp32', num_threads=None, top_k=50, top_p=0.95, temperature=0.7, cache=None,
+                 post_processor=None, spacy_model='en_core_web_sm', metrics=None, prefix_cache=None,
+                 draft_model=None, num_assistant_tokens=5, assistant_confidence_threshold=0.0):
+        self.model_name = model_name
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.precision = precision
+        self.spacy_model = spacy_model
+        self.top_k = top_k
+        self.top_p = top_p
+        self.temperature = temperature
+        # Optional result cache (cache.MemoryCache / cache.SQLiteCache), used for seeded calls
+        self.cache = cache
+        # Pass a PostProcessor with custom rules to change how generated text is cleaned up
+        self.post_processor = post_processor or PostProcessor()
+        # Optional metrics.Metrics and hook callbacks, see add_hook
+        self.metrics = metrics
+        self.hooks = []
+        # Optional prefix_cache.PrefixCache for prompts that share a long preamble
+        self.prefix_cache = prefix_cache
+        # Optional small model sharing the tokenizer (e.g. 'distilgpt2') that drafts
+        # num_assistant_tokens tokens at a time for the main model to verify in one pass
+        self.draft_model_name = draft_model
+        self.num_assistant_tokens = num_assistant_tokens
+        # The draft also stops early once its confidence falls below this; 0 keeps the
+        # lookahead fixed at num_assistant_tokens
+        self.assistant_confidence_threshold = assistant_confidence_threshold
+        self._draft_model = None
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.registry = registry or MODEL_REGISTRY
+        self._tokenizer = None
+        self._model = None
+        self._nlp = None
+        self.batcher = None
+        self.set_comment_bank(comment_bank if comment_bank is not None else TOPIC_COMMENTS)
+
+    # Heavy components are loaded on first use and shared through the registry
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = self.registry.tokenizer(self.model_name)
+        return self._tokenizer
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self.registry.model(self.model_name, self.device, self.precision)
+        return self._model
+
+    @property
+    def draft_model(self):
+        if self._draft_model is None and self.draft_model_name is not None:
+            self._draft_model = self.registry.model(self.draft_model_name, self.device, self.precision)
+        return self._draft_model
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            self._nlp = self.registry.nlp(self.spacy_model)
+        return self._nlp
+
+    def register_prefix(self, prefix):
+        # Precompute the attention cache for a preamble that many inputs start with
+        if self.prefix_cache is None:
+            raise ValueError("register_prefix needs an AIHumanizer created with prefix_cache=PrefixCache(...)")
+        self.prefix_cache.register(self.model, self.tokenizer.encode(prefix))
+
+    def _prefix_kwargs(self, input_ids):
+        # Reuse a cached prefix for single-prompt generation (batched prompts are padded)
+        if self.prefix_cache is None or input_ids.shape[0] != 1:
+            return {}
+        past_key_values = self.prefix_cache.lookup(self.model, input_ids[0].tolist())
+        return {'past_key_values': past_key_values} if past_key_values is not None else {}
+
+    def add_hook(self, hook):
+        # hook(stage, seconds, counts) is called after every instrumented stage
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _stage(self, name):
+        if self.metrics is None and not self.hooks:
+            return NULL_STAGE
+        return StageTimer(self.metrics, self.hooks, name)
+
+    def load(self):
+        # Load every component up front without running any inference
+        self.tokenizer, self.model, self.draft_model, self.nlp
+        return self.startup_times()
+
+    def warmup(self):
+        # Load every component up front and run one tiny request through each of them
+        inputs = self.tokenizer(['Hello world.'], return_tensors='pt').to(self.device)
+        self._generate(inputs['input_ids'], inputs['attention_mask'], max_new_tokens=1)
+        self.add_personal_comments(['Technology and science.'])
+        return self.startup_times()
+
+    def startup_times(self):
+        # Seconds spent loading each component this instance uses (None if not loaded yet)
+        load_times = self.registry.load_times
+        startup_times = {
+            'tokenizer': load_times.get(('tokenizer', self.model_name)),
+            'model': load_times.get(('model', self.model_name, self.device, self.precision)),
+            'spacy': load_times.get(('spacy', self.spacy_model))
+        }
+        if self.draft_model_name is not None:
+            startup_times['draft_model'] = load_times.get(('model', self.draft_model_name, self.device, self.precision))
+        return startup_times
+
+    def check_precision(self, texts):
+        # Quality guard for bf16/int8: compare next-token predictions on `texts`
+        # against the fp32 model (teacher-forced, so no sampling noise)
+        reference = self.registry.model(self.model_name, self.device, 'fp32')
+        inputs = self.tokenizer(texts, return_tensors='pt', padding=True).to(self.device)
+        with torch.inference_mode():
+            logits = self.model(**inputs).logits.float()
+            reference_logits = reference(**inputs).logits.float()
+
+        mask = inputs['attention_mask'].bool()
+        log_probs = torch.log_softmax(logits[mask], dim=-1)
+        reference_log_probs = torch.log_softmax(reference_logits[mask], dim=-1)
+        kl_divergence = (reference_log_probs.exp() * (reference_log_probs - log_probs)).sum(-1).mean()
+        agreement = (log_probs.argmax(-1) == reference_log_probs.argmax(-1)).float().mean()
+        return {'top1_agreement': agreement.item(), 'kl_divergence': kl_divergence.item()}
+
+    def humanize_text(self, ai_text, max_length=150, seed=None):
+        # Sampling is only reproducible with an explicit seed, so only seeded calls are cached
+        if seed is None:
+            return self._humanize_text(ai_text, max_length)
+
+        if self.cache is None:
+            set_seed(seed)
+            return self._humanize_text(ai_text, max_length)
+
+        key = cache_key(
+            ai_text,
+            model_name=self.model_name,
+            precision=self.precision,
+            top_k=self.top_k,
+            top_p=self.top_p,
+            temperature=self.temperature,
             max_length=max_length,
-            num_return_sequences=1,
-            do_sample=True,
-            top_k=50,
-            top_p=0.95,
-            temperature=0.7,
-            pad_token_id=self.tokenizer.pad_token_id
+            seed=seed,
+            comment_bank=self.comment_bank_digest,
+            # The pipeline decides which topics are detected
+            spacy_model=self.spacy_model,
+            post_processor=self.post_processor.digest(),
+            # Assisted sampling draws different tokens than plain sampling for the same seed
+            draft_model=self.draft_model_name,
+            num_assistant_tokens=self.num_assistant_tokens if self.draft_model_name is not None else None,
+            assistant_confidence_threshold=(
+                self.assistant_confidence_threshold if self.draft_model_name is not None else None
+            )
         )
-        humanized_text = self.tokenizer.decode(output[0], skip_special_tokens=True)
+        humanized_text = self.cache.get(key)
+        if humanized_text is None:
+            set_seed(seed)
+            # Generate from the normalized text so every input sharing this key gets the same result
+            humanized_text = self._humanize_text(' '.join(ai_text.split()), max_length)
+            self.cache.set(key, humanized_text)
+        return humanized_text
+
+    def humanize_stream(self, ai_text, max_length=150, stats=None):
+        # Yield the humanized text paragraph by paragraph while tokens are still being
+        # generated. Pass a dict as `stats` to receive time-to-first-token and
+        # inter-token latencies once the stream is exhausted.
+        with self._stage('tokenize') as stage:
+            inputs = self.tokenizer([ai_text], return_tensors='pt').to(self.device)
+            if stage.enabled:
+                stage.count('requests', 1)
+                stage.count('prompt_tokens', inputs['input_ids'].shape[1])
+        max_new_tokens, = self._new_token_budgets([inputs['input_ids'].shape[1]], max_length)
+        # Decoding happens inside the streamer, so it is timed as part of the generate stage
+        streamer = TimedStreamer(self.tokenizer, skip_special_tokens=True)
+        errors = []
+
+        def generate():
+            try:
+                self._generate(
+                    inputs['input_ids'],
+                    inputs['attention_mask'],
+                    max_new_tokens=max_new_tokens,
+                    streamer=streamer,
+                    **self._prefix_kwargs(inputs['input_ids'])
+                )
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+
+        separator = ''
+        buffer = ''
+        # The latest finished sentence is held back until the next one starts: if the text
+        # ends right after it, it is the last sentence and post_process treats it as such
+        held = None
+        for text in streamer:
+            buffer += text
+            # Everything before the last sentence boundary is a finished sentence
+            *sentences, buffer = SENTENCE_BOUNDARY.split(buffer)
+            ready = []
+            for sentence in sentences:
+                if sentence:
+                    if held is not None:
+                        ready.append(held)
+                    held = sentence
+            if held is not None and buffer:
+                ready.append(held)
+                held = None
+            for sentence in ready:
+                paragraph = self.refine_sentence(sentence)
+                if paragraph:
+                    yield separator + paragraph
+                    separator = '\n\n'
+
+        thread.join()
+        if errors:
+            raise errors[0]
+
+        last = buffer or held
+        if last:
+            paragraph = self.refine_sentence(last, last=True)
+            if paragraph:
+                yield separator + paragraph
+
+        if stats is not None:
+            stats.update(streamer.stats())
+
+    def refine_sentence(self, sentence, last=False):
+        # post_process for a single sentence, as used by humanize_stream
+        with self._stage('post_process') as stage:
+            sentence = self.post_processor.apply(sentence, last)
+            if stage.enabled and sentence is not None:
+                stage.count('paragraphs', 1)
+        if sentence is None:
+            return None
+        return self.add_personal_comments([sentence])[0]
+
+    async def ahumanize(self, ai_text, max_length=150):
+        # Concurrent calls are micro-batched into shared generate() calls. A batcher is tied
+        # to its event loop, so a new loop (e.g. another asyncio.run) gets a new batcher.
+        if self.batcher is None or self.batcher.loop is not asyncio.get_running_loop():
+            self.start_batcher()
+        return await self.batcher.submit(ai_text, max_length)
+
+    def start_batcher(self, max_wait_ms=10, max_batch_size=16, max_queue_size=256):
+        # Must be called from the event loop that will call ahumanize
+        self.batcher = MicroBatcher(self, max_wait_ms, max_batch_size, max_queue_size)
+        return self.batcher
+
+    async def stop_batcher(self):
+        if self.batcher is not None:
+            await self.batcher.close()
+            self.batcher = None
+
+    def _humanize_text(self, ai_text, max_length):
+        humanized_text = self.generate_texts([ai_text], max_length)[0]
         return self.post_process(humanized_text)
 
+    def humanize_batch(self, texts, batch_size=8, max_length=150):
+        texts = list(texts)
+        results = [None] * len(texts)
+        if not texts:
+            return results
+
+        # Group inputs of similar token length so each bucket needs little padding
+        lengths = [len(ids) for ids in self.tokenizer(texts)['input_ids']]
+        # Reject over-length inputs before any generation work is done
+        self._new_token_budgets(lengths, max_length)
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            outputs = self.generate_texts([texts[i] for i in bucket], max_length)
+            for i, humanized_text in zip(bucket, outputs):
+                results[i] = self.post_process(humanized_text)
+
+        return results
+
+    def humanize_records(self, texts, batch_size=8, max_length=150):
+        # humanize_batch for bulk corpora, where one bad text must not sink the rest.
+        # Texts that leave nothing to generate within max_length are humanized chunk by
+        # chunk with humanize_document instead. Returns a (humanized text, error) pair per
+        # text, one of them None.
+        texts = list(texts)
+        results = [None] * len(texts)
+        lengths = [len(ids) for ids in self.tokenizer(texts)['input_ids']]
+        fitting = []
+        for i, text in enumerate(texts):
+            if lengths[i] < max_length:
+                fitting.append(i)
+                continue
+            try:
+                results[i] = ('\n\n'.join(self.humanize_document(text)), None)
+            except Exception as e:
+                results[i] = (None, f"{type(e).__name__}: {e}")
+        if fitting:
+            self._humanize_records(texts, fitting, batch_size, max_length, results)
+        return results
+
+    def _humanize_records(self, texts, indices, batch_size, max_length, results):
+        try:
+            outputs = self.humanize_batch([texts[i] for i in indices], batch_size, max_length)
+        except Exception as e:
+            if len(indices) == 1:
+                results[indices[0]] = (None, f"{type(e).__name__}: {e}")
+                return
+            # Bisect until the failing texts are isolated; the rest still run batched
+            middle = len(indices) // 2
+            self._humanize_records(texts, indices[:middle], batch_size, max_length, results)
+            self._humanize_records(texts, indices[middle:], batch_size, max_length, results)
+        else:
+            for i, humanized_text in zip(indices, outputs):
+                results[i] = (humanized_text, None)
+
+    def humanize_document(self, document, chunk_tokens=256, context_tokens=64, max_new_tokens=64):
+        # Humanize a document of any length chunk by chunk, yielding each result as soon
+        # as it is ready. `document` may be a string or an iterable of lines (e.g. a file).
+        if chunk_tokens + context_tokens + max_new_tokens > self.model.config.n_positions:
+            raise ValueError(
+                f"chunk_tokens + context_tokens + max_new_tokens must not exceed "
+                f"the model context of {self.model.config.n_positions} tokens"
+            )
+
+        context_ids = []
+        first = True
+        # About one chunk of text at a time (GPT-2 averages ~4 characters per token), so
+        # neither the buffer nor the spaCy call grows with the document
+        for paragraph in iter_paragraphs(document, max_chars=4 * chunk_tokens):
+            with self._stage('tokenize') as stage:
+                chunks = list(self.iter_chunks(paragraph, chunk_tokens))
+                if stage.enabled:
+                    # One request per document; prompt tokens are the document's own, since
+                    # the carried-over context was already counted as generated
+                    stage.count('requests', int(first))
+                    stage.count('prompt_tokens', sum(map(len, chunks)))
+            first = False
+            for chunk_ids in chunks:
+                # Carry over the tail of the previous output so chunks read as one text
+                input_ids = torch.tensor([context_ids + chunk_ids], device=self.device)
+                output = self._generate(
+                    input_ids,
+                    torch.ones_like(input_ids),
+                    max_new_tokens=max_new_tokens
+                )
+                new_ids = output[0, len(context_ids):].tolist()
+                context_ids = new_ids[-context_tokens:] if context_tokens else []
+                with self._stage('decode'):
+                    text = self.tokenizer.decode(new_ids, skip_special_tokens=True)
+                yield self.post_process(text)
+
+    def iter_chunks(self, paragraph, chunk_tokens):
+        # Pack whole sentences into chunks of at most chunk_tokens tokens
+        chunk_ids = []
+        for sentence in self.nlp(paragraph).sents:
+            sentence_ids = self.tokenizer.encode(sentence.text_with_ws)
+            if chunk_ids and len(chunk_ids) + len(sentence_ids) > chunk_tokens:
+                yield chunk_ids
+                chunk_ids = []
+            # A single sentence longer than a chunk has to be cut mid-sentence
+            while len(sentence_ids) > chunk_tokens:
+                yield sentence_ids[:chunk_tokens]
+                sentence_ids = sentence_ids[chunk_tokens:]
+            chunk_ids.extend(sentence_ids)
+        if chunk_ids:
+            yield chunk_ids
+
+    def generate_texts(self, texts, max_length=150):
+        with self._stage('tokenize') as stage:
+            inputs = self.tokenizer(texts, return_tensors='pt', padding=True).to(self.device)
+            lengths = inputs['attention_mask'].sum(1).tolist()
+            if stage.enabled:
+                stage.count('requests', len(texts))
+                stage.count('prompt_tokens', sum(lengths))
+        # max_length counts each text's own prompt, not the padded batch width, so the batch
+        # runs for the largest budget and every row is cut back to its own
+        budgets = self._new_token_budgets(lengths, max_length)
+        output = self._generate(
+            inputs['input_ids'],
+            inputs['attention_mask'],
+            max_new_tokens=max(budgets),
+            **self._prefix_kwargs(inputs['input_ids'])
+        )
+        width = inputs['input_ids'].shape[1]
+        with self._stage('decode'):
+            return self.tokenizer.batch_decode(
+                [row[:width + budget] for row, budget in zip(output, budgets)],
+                skip_special_tokens=True
+            )
+
+    def _new_token_budgets(self, lengths, max_length):
+        # New tokens each prompt may get under max_length (which includes the prompt)
+        budgets = [max_length - length for length in lengths]
+        for i, budget in enumerate(budgets):
+            if budget < 1:
+                raise ValueError(
+                    f"input {i} is {lengths[i]} tokens, which leaves nothing to generate "
+                    f"within max_length={max_length}"
+                )
+        return budgets
+
+    def _generate(self, input_ids, attention_mask, **length_kwargs):
+        # Assisted generation only supports a single sequence; batches use plain sampling
+        if self.draft_model_name is not None and input_ids.shape[0] == 1:
+            draft_model = self.draft_model
+            # The draft is shared through the registry, so set the lookahead on every call
+            draft_model.generation_config.num_assistant_tokens = self.num_assistant_tokens
+            draft_model.generation_config.num_assistant_tokens_schedule = 'constant'
+            draft_model.generation_config.assistant_confidence_threshold = self.assistant_confidence_threshold
+            length_kwargs['assistant_model'] = draft_model
+
+        with self._stage('generate') as stage, torch.inference_mode():
+            output = self.model.generate(
+                input_ids,
+                attention_mask=attention_mask,
+                num_return_sequences=1,
+                do_sample=True,
+                top_k=self.top_k,
+                top_p=self.top_p,
+                temperature=self.temperature,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **length_kwargs
+            )
+            if stage.enabled:
+                new_tokens = output[:, input_ids.shape[1]:]
+                stage.count('generated_tokens', int((new_tokens != self.tokenizer.pad_token_id).sum()))
+            return output
+
     def post_process(self, text):
-        # Remove redundant phrases and improve sentence structure
-        text = text.replace('\n', ' ')
-        sentences = text.split('. ')
-        sentences = [sentence.capitalize() for sentence in sentences if sentence]
-        processed_text = '. '.join(sentences)
-        if not processed_text.endswith('.'):
-            processed_text += '.'
-        
-        # Additional processing to make the text more human-like
-        processed_text = self.refine_text(processed_text)
-        
-        return processed_text
-
-    def refine_text(self, text):
-        # Split text into paragraphs
-        paragraphs = text.split('. ')
-        refined_paragraphs = []
-        
-        for paragraph in paragraphs:
-            # Further split paragraphs into sentences
-            sentences = paragraph.split('. ')
-            refined_sentences = []
-            
-            for sentence in sentences:
-                # Remove redundant phrases and refine sentence structure
-                if len(sentence) > 10:  # simple check to filter out very short sentences
-                    sentence = sentence.replace('..', '.')
-                    sentence = sentence.strip()
-                    refined_sentences.append(sentence)
-            
-            refined_paragraphs.append('. '.join(refined_sentences))
-        
-        # Add personal comments
-        personal_comments = self.add_personal_comments(refined_paragraphs)
-        
-        return '\n\n'.join(personal_comments)
+        # Split into sentences, clean each one up in a single pass, then add personal comments
+        with self._stage('post_process') as stage:
+            paragraphs = self.post_processor.paragraphs(text)
+            if stage.enabled:
+                stage.count('paragraphs', len(paragraphs))
+        return '\n\n'.join(self.add_personal_comments(paragraphs))
+
+    def set_comment_bank(self, comment_bank):
+        # Accepts a mapping of topic lemma -> comments or a path to a JSON comment bank
+        if isinstance(comment_bank, str):
+            comment_bank = load_comment_bank(comment_bank)
+        self.topic_comments = {topic: tuple(comments) for topic, comments in comment_bank.items()}
+        self.topic_lemmas = frozenset(self.topic_comments)
+        # Comments are part of the output, so a different bank must not share cache entries
+        self.comment_bank_digest = hashlib.sha256(
+            json.dumps(self.topic_comments, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        self._topic_pattern = None
+
+    @property
+    def topic_pattern(self):
+        # Cheap pre-check for words that could lemmatize to a topic. It needs the
+        # lemmatizer's tables, so it is built on first use, once spaCy is loaded.
+        if self._topic_pattern is None:
+            forms = topic_forms(self.nlp, self.topic_lemmas)
+            if forms is None:
+                # Nothing to enumerate the forms from, so every paragraph goes through spaCy
+                self._topic_pattern = re.compile('')
+            else:
+                self._topic_pattern = re.compile(r'\b(?:' + '|'.join(map(re.escape, sorted(forms))) + r')\b')
+        return self._topic_pattern
 
     def add_personal_comments(self, paragraphs):
-        # Define topic-specific personal comments
-        topic_comments = {
-            'technology': [
-                "As a tech enthusiast, I find this development fascinating.",
-                "This reminds me of my own experiences with new gadgets.",
-                "Technology is evolving so quickly; it's hard to keep up!",
-                "I'm always excited about new tech trends.",
-                "This is a breakthrough in the tech industry."
-            ],
-            'science': [
-                "From my perspective, scientific discoveries always bring excitement.",
-                "I believe that science has the potential to solve many of our problems.",
-                "Science constantly amazes me with new findings.",
-                "I'm fascinated by how science can explain so much about our world.",
-                "Scientific research is the key to our future."
-            ],
-            'history': [
-                "As a history buff, I find this period particularly interesting.",
-                "This event had a significant impact on the course of history.",
-                "History teaches us so much about our present.",
-                "I'm always intrigued by historical events like this.",
-                "Studying history gives us insight into our future."
-            ],
-            'health': [
-                "Health is a topic close to my heart.",
-                "In my opinion, maintaining good health should be a priority for everyone.",
-                "I'm always looking for new ways to stay healthy.",
-                "Health trends are constantly changing, it's important to stay informed.",
-                "A healthy lifestyle is essential for a happy life."
-            ],
-            'education': [
-                "Education is the foundation of a successful society.",
-                "I believe that everyone deserves access to quality education.",
-                "Education opens so many doors in life.",
-                "I'm passionate about lifelong learning.",
-                "The education system needs constant improvement."
-            ],
-            'environment': [
-                "Protecting the environment is crucial for our future.",
-                "I believe that environmental conservation should be a priority.",
-                "I'm always looking for ways to reduce my environmental footprint.",
-                "Environmental issues are becoming more urgent every day.",
-                "Sustainable practices are essential for the health of our planet."
-            ],
-            'economy': [
-                "The economy affects every aspect of our lives.",
-                "I believe that economic stability is crucial for a thriving society.",
-                "Economic trends are fascinating to study.",
-                "I'm always interested in learning more about economic policies.",
-                "The global economy is constantly changing."
-            ],
-            'politics': [
-                "Politics play a huge role in shaping our society.",
-                "I believe that everyone should stay informed about political issues.",
-                "Political decisions have far-reaching consequences.",
-                "I'm always interested in discussing political topics.",
-                "The political landscape is constantly evolving."
-            ],
-            'art': [
-                "Art is a powerful form of expression.",
-                "I believe that art has the ability to change the world.",
-                "I'm always inspired by the creativity of artists.",
-                "Art can convey complex emotions and ideas.",
-                "The art world is full of fascinating people and stories."
-            ],
-            'literature': [
-                "Literature opens up new worlds and perspectives.",
-                "I believe that reading is essential for personal growth.",
-                "I'm always looking for new books to read.",
-                "Literature can teach us so much about the human experience.",
-                "The literary world is full of diverse voices and stories."
-            ],
-            'travel': [
-                "Traveling is one of the best ways to learn about the world.",
-                "I believe that travel broadens the mind.",
-                "I'm always planning my next adventure.",
-                "Travel experiences create lifelong memories.",
-                "Exploring new places is always exciting."
-            ],
-            'food': [
-                "Food is a universal language that brings people together.",
-                "I believe that trying new foods is an adventure.",
-                "I'm always on the lookout for new recipes.",
-                "Food has a unique way of connecting cultures.",
-                "Exploring different cuisines is one of my favorite pastimes."
-            ],
-            'sports': [
-                "Sports have the power to unite people.",
-                "I believe that physical activity is crucial for a healthy life.",
-                "I'm always excited to watch my favorite teams play.",
-                "Sports teach valuable lessons about teamwork and perseverance.",
-                "The world of sports is always full of excitement."
-            ],
-            'music': [
-                "Music is a universal language.",
-                "I believe that music has the power to heal.",
-                "I'm always discovering new artists and genres.",
-                "Music can convey emotions that words cannot.",
-                "The music industry is constantly evolving."
-            ],
-            'fashion': [
-                "Fashion is a form of self-expression.",
-                "I believe that everyone should find their own style.",
-                "I'm always excited to see new fashion trends.",
-                "Fashion is about more than just clothes; it's about identity.",
-                "The fashion industry is full of creativity."
-            ],
-            'technology': [
-                "Technology is constantly advancing.",
-                "I believe that technology has the power to improve our lives.",
-                "I'm always intrigued by new tech innovations.",
-                "Technology is shaping the future in unimaginable ways.",
-                "The tech industry is full of opportunities."
-            ],
-            'science': [
-                "Science is a never-ending journey of discovery.",
-                "I believe that scientific research is crucial for progress.",
-                "I'm fascinated by the mysteries of the universe.",
-                "Science can explain so many phenomena in our world.",
-                "The field of science is always evolving."
-            ],
-            'history': [
-                "History is a window into the past.",
-                "I believe that understanding history is essential for our future.",
-                "I'm always learning new things about historical events.",
-                "History helps us understand our present.",
-                "The study of history is full of fascinating stories."
-            ],
-            'health': [
-                "Health is wealth.",
-                "I believe that taking care of our health is paramount.",
-                "I'm always seeking ways to improve my wellbeing.",
-                "Health is a lifelong journey.",
-                "The field of health and wellness is constantly evolving."
-            ],
-            'education': [
-                "Education is the key to success.",
-                "I believe that learning is a lifelong process.",
-                "I'm passionate about the value of education.",
-                "Education empowers individuals and communities.",
-                "The education system needs continuous improvement."
-            ],
-            'environment': [
-                "The environment is our shared responsibility.",
-                "I believe that we must take action to protect our planet.",
-                "I'm always looking for ways to be more eco-friendly.",
-                "Environmental conservation is crucial for our future.",
-                "The state of the environment affects us all."
-            ],
-            'economy': [
-                "The economy is a complex system.",
-                "I believe that understanding economics is important for everyone.",
-                "I'm always interested in economic trends and policies.",
-                "Economic stability is crucial for a prosperous society.",
-                "The global economy is interconnected."
-            ],
-            'politics': [
-                "Politics influence every aspect of our lives.",
-                "I believe that political engagement is crucial for democracy.",
-                "I'm always keeping up with political news.",
-                "Political decisions have wide-ranging impacts.",
-                "The political landscape is always changing."
-            ],
-            'art': [
-                "Art is a reflection of society.",
-                "I believe that art can inspire change.",
-                "I'm always exploring different art forms.",
-                "Art allows us to see the world from different perspectives.",
-                "The world of art is full of creativity."
-            ],
-            'literature': [
-                "Literature opens up new worlds.",
-                "I believe that reading broadens the mind.",
-                "I'm always on the lookout for new books.",
-                "Literature can teach us about different cultures and experiences.",
-                "The literary world is rich with stories."
-            ],
-            'travel': [
-                "Travel broadens the horizons.",
-                "I believe that travel is an essential part of life.",
-                "I'm always planning my next trip.",
-                "Travel experiences create unforgettable memories.",
-                "Exploring new places is always exciting."
-            ],
-            'food': [
-                "Food is a cultural experience.",
-                "I believe that trying new foods is an adventure.",
-                "I'm always excited to try new recipes.",
-                "Food brings people together.",
-                "Exploring different cuisines is one of my passions."
-            ],
-            'sports': [
-                "Sports bring people together.",
-                "I believe that physical activity is crucial for health.",
-                "I'm always excited to watch sporting events.",
-                "Sports teach valuable life lessons.",
-                "The world of sports is full of excitement."
-            ],
-            'music': [
-                "Music is a universal language.",
-                "I believe that music has the power to heal.",
-                "I'm always discovering new music.",
-                "Music can express emotions that words cannot.",
-                "The music industry is ever-changing."
-            ],
-            'fashion': [
-                "Fashion is a form of self-expression.",
-                "I believe that fashion reflects individuality.",
-                "I'm always keeping up with fashion trends.",
-                "Fashion is about more than just clothes.",
-                "The fashion industry is innovative."
-            ],
-            'technology': [
-                "Technology is constantly evolving.",
-                "I believe that technology can change the world.",
-                "I'm fascinated by technological advancements.",
-                "Technology is integral to modern life.",
-                "The tech industry is full of innovation."
-            ],
-            'science': [
-                "Science is a path to understanding.",
-                "I believe that science can solve many problems.",
-                "I'm always interested in scientific discoveries.",
-                "Science explains the workings of the universe.",
-                "The field of science is ever-growing."
-            ],
-            'history': [
-                "History teaches us about our past.",
-                "I believe that history is crucial for understanding the present.",
-                "I'm always learning from historical events.",
-                "History shapes our identity.",
-                "The study of history is enlightening."
-            ],
-            'health': [
-                "Health is the foundation of life.",
-                "I believe in prioritizing health above all.",
-                "I'm always learning about health and wellness.",
-                "Health is a continuous journey.",
-                "The health field is dynamic and evolving."
-            ],
-            'education': [
-                "Education is the key to opportunity.",
-                "I believe in the power of education.",
-                "I'm passionate about lifelong learning.",
-                "Education transforms lives.",
-                "The education system is essential for progress."
-            ],
-            'environment': [
-                "The environment is our collective responsibility.",
-                "I believe in taking action to protect the environment.",
-                "I'm committed to sustainable living.",
-                "Environmental conservation is vital.",
-                "The state of the environment impacts everyone."
-            ],
-            'economy': [
-                "The economy is the backbone of society.",
-                "I believe in understanding economic principles.",
-                "I'm always interested in economic developments.",
-                "Economic health is crucial for a thriving society.",
-                "The global economy is complex and interconnected."
-            ],
-            'politics': [
-                "Politics shape our world.",
-                "I believe in staying informed about political issues.",
-                "I'm engaged in political discussions.",
-                "Political decisions have significant consequences.",
-                "The political climate is constantly shifting."
-            ],
-            'art': [
-                "Art reflects culture.",
-                "I believe that art can inspire change.",
-                "I'm passionate about exploring art.",
-                "Art provides new perspectives.",
-                "The art world is diverse and dynamic."
-            ],
-            'literature': [
-                "Literature expands our horizons.",
-                "I believe in the transformative power of literature.",
-                "I'm always reading new books.",
-                "Literature connects us to different experiences.",
-                "The literary world is vast and varied."
-            ],
-            'travel': [
-                "Travel enriches the soul.",
-                "I believe in the value of travel.",
-                "I'm constantly planning my next trip.",
-                "Travel experiences are invaluable.",
-                "Exploring new places is a passion."
-            ],
-            'food': [
-                "Food is a journey of discovery.",
-                "I believe in the joy of trying new foods.",
-                "I'm always experimenting with new recipes.",
-                "Food brings people together.",
-                "Exploring cuisines is a delightful experience."
-            ],
-            'sports': [
-                "Sports foster unity.",
-                "I believe in the importance of physical activity.",
-                "I'm enthusiastic about watching sports.",
-                "Sports teach perseverance and teamwork.",
-                "The sports world is thrilling."
-            ],
-            'music': [
-                "Music transcends boundaries.",
-                "I believe in the healing power of music.",
-                "I'm always exploring new music genres.",
-                "Music communicates emotions beautifully.",
-                "The music industry is ever-evolving."
-            ],
-            'fashion': [
-                "Fashion expresses individuality.",
-                "I believe in the creativity of fashion.",
-                "I'm always keeping up with fashion trends.",
-                "Fashion is a form of art.",
-                "The fashion industry is innovative and exciting."
-            ]
-        }
-        
-        refined_paragraphs_with_comments = []
-        
-        for paragraph in paragraphs:
-            if paragraph.strip():
-                doc = self.nlp(paragraph)
-                topics = set()
-                for token in doc:
-                    if token.lemma_ in topic_comments:
-                        topics.add(token.lemma_)
-                
-                if topics:
-                    comment = random.choice(topic_comments[next(iter(topics))])
-                    paragraph = f"{paragraph}. {comment}"
-                    
-                refined_paragraphs_with_comments.append(paragraph)
-        
-        return refined_paragraphs_with_comments
+        with self._stage('topic_detection') as stage:
+            return self._add_personal_comments(paragraphs, stage)
+
+    def _add_personal_comments(self, paragraphs, stage):
+        paragraphs = [paragraph for paragraph in paragraphs if paragraph.strip()]
+
+        if not self.topic_lemmas:
+            return paragraphs
+        # Only paragraphs that mention a candidate topic word go through spaCy
+        topic_pattern = self.topic_pattern
+        candidates = [i for i, paragraph in enumerate(paragraphs) if topic_pattern.search(paragraph.lower())]
+        if not candidates:
+            return paragraphs
+        if stage.enabled:
+            stage.count('spacy_paragraphs', len(candidates))
+
+        # Sentence boundaries are not needed here. They are disabled per call: the pipeline is
+        # shared process-wide, and iter_chunks on another thread still needs them.
+        sentence_pipes = [name for name in self.nlp.pipe_names if name in ('senter', 'sentencizer')]
+        docs = self.nlp.pipe((paragraphs[i] for i in candidates), disable=sentence_pipes)
+        for i, doc in zip(candidates, docs):
+            # In order of first mention, so the choice does not depend on set/hash order
+            topics = []
+            for token in doc:
+                if token.lemma_ in self.topic_lemmas and token.lemma_ not in topics:
+                    topics.append(token.lemma_)
+
+            if topics:
+                comment = random.choice(self.topic_comments[topics[0]])
+                paragraphs[i] = f"{paragraphs[i]}. {comment}"
+                if stage.enabled:
+                    stage.count('topic_hits', len(topics))
+                    stage.count('comments_inserted', 1)
+
+        return paragraphs
+
+def iter_paragraphs(document, max_chars=None):
+    # Yield blank-line separated paragraphs without holding more than one in memory.
+    # With max_chars, a paragraph is flushed at the first line boundary past max_chars and
+    # longer lines are cut at a space, so files without blank lines stay bounded too.
+    lines = io.StringIO(document) if isinstance(document, str) else document
+    paragraph = []
+    size = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if paragraph:
+                yield ' '.join(paragraph)
+                paragraph, size = [], 0
+            continue
+
+        while max_chars and len(line) > max_chars:
+            if paragraph:
+                yield ' '.join(paragraph)
+                paragraph, size = [], 0
+            cut = line.rfind(' ', 0, max_chars + 1)
+            if cut <= 0:
+                cut = max_chars
+            yield line[:cut]
+            line = line[cut:].lstrip()
+        if not line:
+            continue
+
+        paragraph.append(line)
+        size += len(line) + 1
+        if max_chars and size > max_chars:
+            yield ' '.join(paragraph)
+            paragraph, size = [], 0
+    if paragraph:
+        yield ' '.join(paragraph)
 
 # Kullanıcıdan metin alıp dönüştüren kısım
 if __name__ == "__main__":
-    ai_text = input("Lütfen dönüştürmek istediğiniz AI tarafından üretilmiş metni girin: ")
-    humanizer = AIHumanizer()
-    humanized_text = humanizer.humanize_text(ai_text)
-    print("Orijinal AI Metni: ", ai_text)
-    print("İnsan Tarafından Yazılmış Gibi Metin: ", humanized_text)
+    # With arguments, run the bulk corpus CLI (see cli.py); otherwise ask for a single text
+    if len(sys.argv) > 1:
+        from cli import main
+        main()
+    else:
+        ai_text = input("Lütfen dönüştürmek istediğiniz AI tarafından üretilmiş metni girin: ")
+        humanizer = AIHumanizer()
+        humanized_text = humanizer.humanize_text(ai_text)
+        print("Orijinal AI Metni: ", ai_text)
+        print("İnsan Tarafından Yazılmış Gibi Metin: ", humanized_text)
@@ -0,0 +1,110 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MicroBatcher:
+    # Collects concurrent async requests for up to max_wait_ms or max_batch_size items and
+    # runs them as one padded generate() call on a worker thread, off the event loop.
+    # max_queue_size bounds pending requests; submitters wait when it is full.
+    def __init__(self, humanizer, max_wait_ms=10, max_batch_size=16, max_queue_size=256):
+        self.humanizer = humanizer
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.queue = asyncio.Queue(max_queue_size)
+        self.batches = 0
+        self.requests = 0
+        self.closed = False
+        # The queue and the worker task belong to this loop and cannot be used from another
+        self.loop = asyncio.get_running_loop()
+        # A single thread: the model is not safe to drive from several threads at once
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # Requests taken off the queue but not answered yet
+        self._batch = []
+        self._task = self.loop.create_task(self._run())
+
+    async def submit(self, text, max_length=150):
+        if asyncio.get_running_loop() is not self.loop:
+            raise RuntimeError('MicroBatcher used from a different event loop than it was started on')
+        if self.closed:
+            raise RuntimeError('batcher closed')
+        future = self.loop.create_future()
+        await self.queue.put((text, max_length, future))
+        # The batcher may have closed while we waited for room in the queue
+        if self.closed and not future.done():
+            future.set_exception(RuntimeError('batcher closed'))
+        return await future
+
+    async def _run(self):
+        try:
+            await self._serve()
+        except asyncio.CancelledError:
+            self.closed = True
+            self._fail_pending()
+            self._executor.shutdown(wait=False)
+            raise
+
+    def _fail_pending(self):
+        # Nobody will answer these any more, so fail them instead of leaving callers waiting
+        pending = [future for _, _, future in self._batch]
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait()[2])
+        for future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError('batcher closed'))
+        self._batch = []
+
+    async def _serve(self):
+        loop = self.loop
+        while True:
+            batch = self._batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Requests sharing a max_length can share a generate() call
+            groups = {}
+            for text, max_length, future in batch:
+                if not future.cancelled():
+                    groups.setdefault(max_length, []).append((text, future))
+
+            for max_length, items in groups.items():
+                await self._run_group(items, max_length)
+                self.batches += 1
+                self.requests += len(items)
+            self._batch = []
+
+    async def _run_group(self, items, max_length):
+        texts = [text for text, _ in items]
+        try:
+            results = await self.loop.run_in_executor(
+                self._executor, self.humanizer.humanize_batch, texts, len(texts), max_length
+            )
+        except Exception as e:
+            if len(items) == 1:
+                if not items[0][1].done():
+                    items[0][1].set_exception(e)
+                return
+            # One bad request must not fail the others batched with it: bisect until each
+            # caller gets its own result or its own error
+            middle = len(items) // 2
+            await self._run_group(items[:middle], max_length)
+            await self._run_group(items[middle:], max_length)
+        else:
+            for (_, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def close(self):
+        # Queued and in-flight requests fail with RuntimeError('batcher closed')
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown(wait=True)
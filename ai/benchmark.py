@@ -0,0 +1,667 @@
+import argparse
+import asyncio
+import cProfile
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+import spacy
+import torch
+
+from transformers import GPT2Config, GPT2LMHeadModel, GPT2Tokenizer, set_seed
+
+from ai_ import AIHumanizer
+from metrics import Metrics
+from pool import HumanizerPool
+from prefix_cache import PrefixCache
+
+SAMPLE_SENTENCES = [
+    "Technology has changed the way people communicate with each other.",
+    "Scientific research continues to reveal new facts about the universe.",
+    "History shows that societies adapt to difficult circumstances.",
+    "A balanced diet and regular exercise are important for good health.",
+    "Education gives young people the tools they need to succeed.",
+    "Protecting the environment requires cooperation between countries.",
+    "The economy depends on consumer confidence and stable prices.",
+    "Music and art help people express feelings that are hard to describe.",
+]
+
+
+def _bytes_to_unicode():
+    # GPT-2's byte-level alphabet: every byte maps to a printable unicode character
+    byte_values = (list(range(ord('!'), ord('~') + 1)) + list(range(ord('\xa1'), ord('\xac') + 1))
+                   + list(range(ord('\xae'), ord('\xff') + 1)))
+    chars = byte_values[:]
+    extra = 0
+    for b in range(256):
+        if b not in byte_values:
+            byte_values.append(b)
+            chars.append(256 + extra)
+            extra += 1
+    return dict(zip(byte_values, map(chr, chars)))
+
+
+def make_tiny_models(directory, draft=False):
+    # A randomly initialized 2-layer GPT-2 with a byte-level vocabulary (no merges, hence
+    # the long context) and a blank spaCy pipeline, so the benchmarks run offline and
+    # without a GPU. Outputs are gibberish; only the timings mean anything.
+    model_dir = os.path.join(directory, 'tiny-gpt2')
+    spacy_dir = os.path.join(directory, 'blank-spacy')
+    os.makedirs(model_dir, exist_ok=True)
+
+    vocab = {char: i for i, char in enumerate(_bytes_to_unicode().values())}
+    vocab['<|endoftext|>'] = eos_token_id = len(vocab)
+    vocab_file = os.path.join(model_dir, 'vocab.json')
+    merges_file = os.path.join(model_dir, 'merges.txt')
+    with open(vocab_file, 'w', encoding='utf-8') as f:
+        json.dump(vocab, f)
+    with open(merges_file, 'w', encoding='utf-8') as f:
+        f.write('#version: 0.2\n')
+    GPT2Tokenizer(vocab_file, merges_file).save_pretrained(model_dir)
+
+    config = GPT2Config(vocab_size=len(vocab), n_positions=2048, n_embd=64, n_layer=2, n_head=2,
+                        bos_token_id=eos_token_id, eos_token_id=eos_token_id)
+    torch.manual_seed(0)
+    GPT2LMHeadModel(config).save_pretrained(model_dir)
+
+    nlp = spacy.blank('en')
+    nlp.add_pipe('sentencizer')
+    nlp.to_disk(spacy_dir)
+    if not draft:
+        return model_dir, spacy_dir
+
+    # Same tokenizer, a single narrower layer: a stand-in for distilgpt2 next to gpt2-medium
+    draft_dir = os.path.join(directory, 'tiny-gpt2-draft')
+    GPT2Tokenizer(vocab_file, merges_file).save_pretrained(draft_dir)
+    config = GPT2Config(vocab_size=len(vocab), n_positions=2048, n_embd=32, n_layer=1, n_head=2,
+                        bos_token_id=eos_token_id, eos_token_id=eos_token_id)
+    GPT2LMHeadModel(config).save_pretrained(draft_dir)
+    return model_dir, spacy_dir, draft_dir
+
+
+def make_corpus(num_docs, min_sentences=1, max_sentences=4, seed=0):
+    rng = random.Random(seed)
+    return [
+        ' '.join(rng.choice(SAMPLE_SENTENCES) for _ in range(rng.randint(min_sentences, max_sentences)))
+        for _ in range(num_docs)
+    ]
+
+
+def bench_batch(humanizer, texts, batch_sizes, max_length=150):
+    # Baseline: one generate call per document
+    start = time.perf_counter()
+    for text in texts:
+        humanizer.humanize_text(text, max_length=max_length)
+    elapsed = time.perf_counter() - start
+    print(f"single-text loop:  {len(texts) / elapsed:8.2f} docs/s")
+
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        humanizer.humanize_batch(texts, batch_size=batch_size, max_length=max_length)
+        elapsed = time.perf_counter() - start
+        print(f"batch_size={batch_size:<6} {len(texts) / elapsed:8.2f} docs/s")
+
+
+def legacy_paragraphs(text):
+    # The split-based post_process/refine_text pipeline that PostProcessor replaced,
+    # minus personal comments. Kept as the golden reference for its output.
+    text = text.replace('\n', ' ')
+    sentences = [sentence.capitalize() for sentence in text.split('. ') if sentence]
+    processed_text = '. '.join(sentences)
+    if not processed_text.endswith('.'):
+        processed_text += '.'
+
+    refined_paragraphs = []
+    for paragraph in processed_text.split('. '):
+        refined_sentences = []
+        for sentence in paragraph.split('. '):
+            if len(sentence) > 10:
+                refined_sentences.append(sentence.replace('..', '.').strip())
+        refined_paragraphs.append('. '.join(refined_sentences))
+    return [paragraph for paragraph in refined_paragraphs if paragraph.strip()]
+
+
+GOLDEN_CASES = [
+    "",
+    ".",
+    "short. tiny. ok",
+    "the quick brown fox jumps. over the lazy dog",
+    "Ends with a full stop and nothing after it. ",
+    "Multiple. . empty. .. sentences here and there.. and more text follows",
+    "Line one is long enough\nline two is also long enough.\nthird line without period",
+    "  leading spaces in this sentence.   trailing spaces in this one   . x",
+    "UPPER CASE SENTENCE GETS LOWERED. mIxEd CaSe sentence goes here...",
+    "Numbers like 3. 14 split oddly. e.g. abbreviations also split. Final one",
+]
+
+
+def check_golden(post_processor, texts):
+    return [text for text in texts if post_processor.paragraphs(text) != legacy_paragraphs(text)]
+
+
+def _time_and_peak(func, *args, repeats=1):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func(*args)
+    elapsed = (time.perf_counter() - start) / repeats
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_post_process(humanizer, num_paragraphs=200, size_mb=1):
+    # Golden check: the single-pass engine must reproduce the old pipeline exactly
+    mismatches = check_golden(humanizer.post_processor, GOLDEN_CASES + make_corpus(200))
+    for text in mismatches:
+        print(f"golden mismatch: {text!r}")
+    print(f"golden output: {'ok' if not mismatches else 'FAILED'}")
+
+    # post_process treats every '. '-separated piece as a paragraph
+    text = '. '.join(make_corpus(num_paragraphs, max_sentences=1)).replace('.. ', '. ')
+    humanizer.post_process(text)
+    elapsed, peak = _time_and_peak(humanizer.post_process, text, repeats=20)
+    print(f"post_process ({num_paragraphs} paragraphs): {elapsed * 1000:8.2f} ms/call, "
+          f"peak {peak / 1024:8.1f} KiB/call")
+
+    # Sentence handling alone (no spaCy) on a large input, old pipeline vs. engine
+    text = ''
+    while len(text) < size_mb * 2**20:
+        text += ' '.join(make_corpus(1000, seed=len(text))) + '\n'
+    for name, func in (('split-based', legacy_paragraphs), ('single-pass', humanizer.post_processor.paragraphs)):
+        elapsed, peak = _time_and_peak(func, text, repeats=3)
+        print(f"{name:<12} ({len(text) / 2**20:.1f} MiB): {elapsed * 1000:8.1f} ms, "
+              f"peak {peak / 2**20:8.1f} MiB")
+    return not mismatches
+
+
+def bench_spacy(humanizer, texts, max_length=150):
+    # Share of humanize_text latency spent in spaCy topic detection
+    spacy_time = 0.0
+    add_personal_comments = humanizer.add_personal_comments
+
+    def timed_add_personal_comments(paragraphs):
+        nonlocal spacy_time
+        start = time.perf_counter()
+        result = add_personal_comments(paragraphs)
+        spacy_time += time.perf_counter() - start
+        return result
+
+    humanizer.add_personal_comments = timed_add_personal_comments
+    start = time.perf_counter()
+    for text in texts:
+        humanizer.humanize_text(text, max_length=max_length)
+    total_time = time.perf_counter() - start
+    del humanizer.add_personal_comments
+
+    print(f"spaCy topic detection: {spacy_time / len(texts) * 1000:8.2f} ms/request, "
+          f"{spacy_time / total_time:6.1%} of humanize_text")
+
+
+def bench_startup(humanizer):
+    start = time.perf_counter()
+    startup_times = humanizer.warmup()
+    elapsed = time.perf_counter() - start
+    for component, seconds in startup_times.items():
+        print(f"{component:<10} {seconds:8.2f} s")
+    print(f"{'warmup':<10} {elapsed:8.2f} s")
+
+
+def bench_pool(model_name, texts, process_counts, max_length=150, **humanizer_kwargs):
+    for processes in process_counts:
+        with HumanizerPool(model_name, processes=processes, **humanizer_kwargs) as pool:
+            start = time.perf_counter()
+            pool.humanize_texts(texts, max_length)
+            elapsed = time.perf_counter() - start
+            stats = pool.stats()
+
+        print(f"processes={processes:<4} {len(texts) / elapsed:8.2f} docs/s")
+        for pid, worker in sorted(stats['workers'].items()):
+            private = f"{worker['private'] / 2**20:8.1f} MiB" if worker['private'] is not None else "       ?"
+            print(f"  worker {pid:<8} {worker['requests']:5d} requests {worker['throughput']:8.2f} docs/s "
+                  f"rss {worker['rss'] / 2**20:8.1f} MiB private {private}")
+
+
+def _measure_precision(model_name, precision, texts, new_tokens, num_threads, humanizer_kwargs):
+    humanizer = AIHumanizer(model_name, device='cpu', precision=precision, num_threads=num_threads,
+                            **humanizer_kwargs)
+    humanizer.warmup()
+    inputs = humanizer.tokenizer(texts, return_tensors='pt', padding=True)
+
+    start = time.perf_counter()
+    humanizer._generate(
+        inputs['input_ids'],
+        inputs['attention_mask'],
+        max_new_tokens=new_tokens,
+        min_new_tokens=new_tokens
+    )
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    result = {'tokens_per_second': len(texts) * new_tokens / elapsed, 'peak_rss': peak_rss}
+    if precision != 'fp32':
+        result.update(humanizer.check_precision(texts))
+    return result
+
+
+def bench_precision(model_name, texts, precisions, new_tokens=64, num_threads=None, min_agreement=0.9,
+                    **humanizer_kwargs):
+    # Each mode runs in a fresh process so peak RSS is not inflated by the others
+    context = multiprocessing.get_context('spawn')
+    passed = True
+    for precision in precisions:
+        with context.Pool(1) as pool:
+            try:
+                result = pool.apply(_measure_precision, (model_name, precision, texts, new_tokens, num_threads, humanizer_kwargs))
+            except ValueError as e:
+                print(f"{precision:<5} skipped: {e}")
+                continue
+
+        line = (f"{precision:<5} {result['tokens_per_second']:8.2f} tokens/s "
+                f"peak rss {result['peak_rss'] / 2**20:8.1f} MiB")
+        if 'top1_agreement' in result:
+            ok = result['top1_agreement'] >= min_agreement
+            passed = passed and ok
+            line += (f"  top-1 agreement {result['top1_agreement']:6.1%} "
+                     f"KL {result['kl_divergence']:.4f} {'ok' if ok else 'FAILED'}")
+        print(line)
+    return passed
+
+
+def _percentiles(latencies):
+    latencies = sorted(latencies)
+    return {p: latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] for p in (50, 95, 99)}
+
+
+def _report(name, latencies, elapsed):
+    p = _percentiles(latencies)
+    print(f"{name:<16} {len(latencies) / elapsed:8.2f} req/s  p50 {p[50] * 1000:8.1f} ms  "
+          f"p95 {p[95] * 1000:8.1f} ms  p99 {p[99] * 1000:8.1f} ms")
+
+
+async def _load_test(humanizer, texts, concurrency, max_length, batched):
+    # `concurrency` clients each send their share of texts back to back
+    latencies = []
+    lock = asyncio.Lock()
+
+    async def request(text):
+        start = time.perf_counter()
+        if batched:
+            await humanizer.ahumanize(text, max_length)
+        else:
+            # One request at a time: every call waits for the previous generate to finish
+            async with lock:
+                await asyncio.to_thread(humanizer.humanize_text, text, max_length)
+        latencies.append(time.perf_counter() - start)
+
+    async def client(client_texts):
+        for text in client_texts:
+            await request(text)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(texts[i::concurrency]) for i in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+def bench_async(humanizer, texts, concurrency=16, max_length=150, max_wait_ms=10, max_batch_size=16):
+    async def run():
+        latencies, elapsed = await _load_test(humanizer, texts, concurrency, max_length, batched=False)
+        _report('one-at-a-time', latencies, elapsed)
+
+        humanizer.start_batcher(max_wait_ms, max_batch_size)
+        latencies, elapsed = await _load_test(humanizer, texts, concurrency, max_length, batched=True)
+        _report('micro-batched', latencies, elapsed)
+        print(f"{humanizer.batcher.requests / humanizer.batcher.batches:.1f} requests per batch")
+        await humanizer.stop_batcher()
+
+    asyncio.run(run())
+
+
+def bench_stream(humanizer, texts, max_length=150):
+    # Time to first token / first paragraph of humanize_stream vs. a blocking humanize_text call
+    blocking, first_token, first_paragraph, inter_token = [], [], [], []
+    for text in texts:
+        start = time.perf_counter()
+        humanizer.humanize_text(text, max_length)
+        blocking.append(time.perf_counter() - start)
+
+        stats = {}
+        start = time.perf_counter()
+        for i, _ in enumerate(humanizer.humanize_stream(text, max_length, stats=stats)):
+            if i == 0:
+                first_paragraph.append(time.perf_counter() - start)
+        if stats['time_to_first_token'] is not None:
+            first_token.append(stats['time_to_first_token'])
+        inter_token.extend(stats['inter_token_latencies'])
+
+    def mean_ms(values):
+        return sum(values) / len(values) * 1000 if values else float('nan')
+
+    print(f"humanize_text:          {mean_ms(blocking):8.1f} ms")
+    print(f"time to first token:    {mean_ms(first_token):8.1f} ms")
+    print(f"time to first paragraph:{mean_ms(first_paragraph):8.1f} ms")
+    print(f"inter-token latency:    {mean_ms(inter_token):8.1f} ms")
+
+
+def bench_metrics(humanizer, texts, max_length=150, iterations=100000):
+    # Instrumentation cost: per-stage overhead in isolation, then end-to-end humanize_text
+    def stage_overhead():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with humanizer._stage('overhead') as stage:
+                if stage.enabled:
+                    stage.count('calls', 1)
+        return (time.perf_counter() - start) / iterations
+
+    def end_to_end():
+        start = time.perf_counter()
+        for text in texts:
+            humanizer.humanize_text(text, max_length, seed=0)
+        return (time.perf_counter() - start) / len(texts)
+
+    humanizer.metrics = None
+    disabled_stage, disabled_request = stage_overhead(), end_to_end()
+    humanizer.metrics = Metrics()
+    enabled_stage, enabled_request = stage_overhead(), end_to_end()
+    humanizer.metrics = None
+
+    print(f"per stage:   disabled {disabled_stage * 1e9:8.0f} ns  enabled {enabled_stage * 1e9:8.0f} ns")
+    print(f"per request: disabled {disabled_request * 1000:8.2f} ms  enabled {enabled_request * 1000:8.2f} ms")
+
+
+PREAMBLE = (
+    "Rewrite the following paragraph so that it sounds natural, friendly and personal. "
+    "Keep every fact, avoid jargon and prefer short sentences over long ones. "
+    "Use plain words that a general audience understands.\n"
+)
+
+
+def bench_prefix(humanizer, texts, new_tokens=32, auto_register_after=None):
+    # Inputs share a long preamble; compare generation with and without the prefix cache
+    prompts = [PREAMBLE + text for text in texts]
+    max_length = max(len(humanizer.tokenizer.encode(prompt)) for prompt in prompts) + new_tokens
+
+    def run():
+        start = time.perf_counter()
+        for seed, prompt in enumerate(prompts):
+            humanizer.humanize_text(prompt, max_length, seed=seed)
+        return (time.perf_counter() - start) / len(prompts)
+
+    humanizer.prefix_cache = None
+    uncached = run()
+    humanizer.prefix_cache = PrefixCache(auto_register_after=auto_register_after)
+    if not auto_register_after:
+        humanizer.register_prefix(PREAMBLE)
+    cached = run()
+    stats = humanizer.prefix_cache.stats()
+    humanizer.prefix_cache = None
+
+    print(f"without prefix cache: {uncached * 1000:8.2f} ms/request")
+    print(f"with prefix cache:    {cached * 1000:8.2f} ms/request")
+    print(f"hit rate {stats['hit_rate']:.1%}, {stats['tokens_saved']} prefill tokens and "
+          f"{stats['prefill_seconds_saved'] * 1000:.1f} ms of prefill saved, {stats['bytes'] / 2**20:.1f} MiB cached")
+
+
+def _sample_continuations(humanizer, texts, new_tokens, seed):
+    # One prompt at a time, since assisted generation only supports a single sequence
+    set_seed(seed)
+    continuations = []
+    start = time.perf_counter()
+    for text in texts:
+        inputs = humanizer.tokenizer([text], return_tensors='pt').to(humanizer.device)
+        output = humanizer._generate(inputs['input_ids'], inputs['attention_mask'],
+                                     max_new_tokens=new_tokens, min_new_tokens=new_tokens)
+        continuations.append((inputs['input_ids'][0].tolist(), output[0, inputs['input_ids'].shape[1]:].tolist()))
+    return continuations, time.perf_counter() - start
+
+
+def _sequence_log_probs(humanizer, continuations):
+    # Per sample, the average log-probability the main model assigns to the sampled tokens
+    means = []
+    with torch.inference_mode():
+        for prompt_ids, new_ids in continuations:
+            input_ids = torch.tensor([prompt_ids + new_ids], device=humanizer.device)
+            log_probs = torch.log_softmax(humanizer.model(input_ids).logits[0, len(prompt_ids) - 1:-1].float(), dim=-1)
+            means.append(log_probs.gather(1, torch.tensor(new_ids, device=humanizer.device)[:, None]).mean().item())
+    return means
+
+
+def _z_score(a, b):
+    # Two-sample z statistic for the difference of means
+    mean_a, mean_b = sum(a) / len(a), sum(b) / len(b)
+    var_a = sum((x - mean_a) ** 2 for x in a) / (len(a) - 1)
+    var_b = sum((x - mean_b) ** 2 for x in b) / (len(b) - 1)
+    standard_error = math.sqrt(var_a / len(a) + var_b / len(b))
+    return (mean_a - mean_b) / standard_error if standard_error else 0.0
+
+
+def _total_variation(a, b):
+    # Distance between the token frequency distributions of two sets of samples
+    a = Counter(token for _, new_ids in a for token in new_ids)
+    b = Counter(token for _, new_ids in b for token in new_ids)
+    total_a, total_b = sum(a.values()), sum(b.values())
+    return 0.5 * sum(abs(a[token] / total_a - b[token] / total_b) for token in set(a) | set(b))
+
+
+def _permutation_p_value(a, b, permutations=1000, seed=0):
+    # How often a random split of the pooled samples is at least as far apart in token
+    # TV as the real split. Whole samples are shuffled, since tokens within one are correlated.
+    observed = _total_variation(a, b)
+    pooled = a + b
+    rng = random.Random(seed)
+    at_least = 0
+    for _ in range(permutations):
+        rng.shuffle(pooled)
+        at_least += _total_variation(pooled[:len(a)], pooled[len(a):]) >= observed
+    return observed, (at_least + 1) / (permutations + 1)
+
+
+def _compare(name, rate, reference, samples, reference_log_probs, log_probs, max_z, min_p):
+    z = _z_score(log_probs, reference_log_probs)
+    distance, p_value = _permutation_p_value(reference, samples)
+    ok = abs(z) <= max_z and p_value >= min_p
+    print(f"{name:<22} {rate:8.2f} tokens/s  mean log-prob {sum(log_probs) / len(log_probs):7.3f} (z {z:+5.2f})  "
+          f"token TV {distance:.3f} (p {p_value:.3f})  {'ok' if ok else 'MISMATCH'}")
+    return ok
+
+
+def bench_assisted(humanizer, draft_model, texts, new_tokens=32, lookaheads=(3, 5, 8), max_z=3.5, min_p=0.001):
+    # Tokens/s of plain sampling vs. assisted generation with a draft model, plus two-sample
+    # tests that the assisted samples come from the same distribution as plain sampling:
+    # a z-test on the main model's mean log-prob per sample and a permutation test on the
+    # token frequency TV. A plain run with another seed shows what passing looks like.
+    humanizer.draft_model_name = None
+    plain, elapsed = _sample_continuations(humanizer, texts, new_tokens, seed=0)
+    plain_log_probs = _sequence_log_probs(humanizer, plain)
+    total_tokens = len(texts) * new_tokens
+    print(f"{'plain generate':<22} {total_tokens / elapsed:8.2f} tokens/s  "
+          f"mean log-prob {sum(plain_log_probs) / len(plain_log_probs):7.3f}")
+    reseeded, elapsed = _sample_continuations(humanizer, texts, new_tokens, seed=1)
+    passed = _compare('plain, another seed', total_tokens / elapsed, plain, reseeded, plain_log_probs,
+                      _sequence_log_probs(humanizer, reseeded), max_z, min_p)
+
+    humanizer.draft_model_name = draft_model
+    humanizer.load()
+    for lookahead in lookaheads:
+        humanizer.num_assistant_tokens = lookahead
+        assisted, elapsed = _sample_continuations(humanizer, texts, new_tokens, seed=0)
+        passed &= _compare(f'assisted lookahead={lookahead}', total_tokens / elapsed, plain, assisted,
+                           plain_log_probs, _sequence_log_probs(humanizer, assisted), max_z, min_p)
+    humanizer.draft_model_name = None
+    humanizer._draft_model = None
+    return passed
+
+
+STAGES = ('tokenize', 'generate', 'decode', 'post_process', 'add_personal_comments')
+
+
+def _summary(times):
+    times = sorted(times)
+    return {
+        'total': sum(times),
+        'mean': sum(times) / len(times),
+        'p50': times[len(times) // 2],
+        'p95': times[min(len(times) - 1, int(len(times) * 0.95))]
+    }
+
+
+def _time_stages(humanizer, texts, new_tokens):
+    timings = {stage: [] for stage in STAGES}
+    for text in texts:
+        t0 = time.perf_counter()
+        inputs = humanizer.tokenizer([text], return_tensors='pt').to(humanizer.device)
+        t1 = time.perf_counter()
+        output = humanizer._generate(inputs['input_ids'], inputs['attention_mask'], max_new_tokens=new_tokens)
+        t2 = time.perf_counter()
+        decoded = humanizer.tokenizer.batch_decode(output, skip_special_tokens=True)[0]
+        t3 = time.perf_counter()
+        paragraphs = humanizer.post_processor.paragraphs(decoded)
+        t4 = time.perf_counter()
+        humanizer.add_personal_comments(paragraphs)
+        t5 = time.perf_counter()
+        for stage, elapsed in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+            timings[stage].append(elapsed)
+    return {stage: _summary(times) for stage, times in timings.items()}
+
+
+def bench_stages(humanizer, corpus_sizes, docs, new_tokens=64, profile=None, profile_path=None):
+    # Per-stage timings of humanize_text over corpora of increasing document length.
+    # generate() always produces new_tokens tokens so runs are comparable across sizes.
+    results = {
+        'model': humanizer.model_name,
+        'device': humanizer.device,
+        'precision': humanizer.precision,
+        'torch': torch.__version__,
+        'startup': humanizer.load(),
+        'runs': []
+    }
+    humanizer.warmup()
+
+    profiler = None
+    if profile == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile == 'torch':
+        profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+        profiler.__enter__()
+
+    for sentences in corpus_sizes:
+        texts = make_corpus(docs, sentences, sentences, seed=sentences)
+        stages = _time_stages(humanizer, texts, new_tokens)
+        results['runs'].append({
+            'sentences_per_doc': sentences,
+            'docs': docs,
+            'chars_per_doc': sum(map(len, texts)) / len(texts),
+            'stages': stages
+        })
+
+    if profile == 'cprofile':
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+    elif profile == 'torch':
+        profiler.__exit__(None, None, None)
+        profiler.export_chrome_trace(profile_path)
+    return results
+
+
+def print_stages(results):
+    for component, seconds in results['startup'].items():
+        print(f"load {component:<22} {seconds * 1000:10.1f} ms")
+    for run in results['runs']:
+        print(f"-- {run['docs']} docs x {run['sentences_per_doc']} sentences")
+        for stage, summary in run['stages'].items():
+            print(f"   {stage:<24} mean {summary['mean'] * 1000:8.2f} ms  p95 {summary['p95'] * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AIHumanizer benchmarks")
+    parser.add_argument('benchmark', choices=['stages', 'batch', 'postprocess', 'spacy', 'startup', 'pool', 'precision', 'async', 'stream', 'metrics', 'prefix', 'assisted'])
+    parser.add_argument('--model', default='gpt2-medium')
+    parser.add_argument('--docs', type=int, default=64)
+    parser.add_argument('--max-length', type=int, default=150)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--paragraphs', type=int, default=200)
+    parser.add_argument('--size-mb', type=float, default=1)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    parser.add_argument('--precisions', nargs='+', default=['fp32', 'bf16', 'int8'])
+    parser.add_argument('--new-tokens', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--min-agreement', type=float, default=0.9,
+                        help="minimum top-1 agreement with fp32 for the quality guard to pass")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--spacy-full', action='store_true',
+                        help="use the full en_core_web_sm pipeline for a before/after comparison")
+    parser.add_argument('--auto-register-after', type=int, default=None,
+                        help="let the prefix cache discover the preamble instead of registering it")
+    parser.add_argument('--draft-model', default='distilgpt2')
+    parser.add_argument('--assistant-confidence-threshold', type=float, default=0.0,
+                        help="draft stops early below this confidence (0 keeps the lookahead fixed)")
+    parser.add_argument('--lookaheads', type=int, nargs='+', default=[3, 5, 8],
+                        help="num_assistant_tokens values for the 'assisted' benchmark")
+    parser.add_argument('--tiny', action='store_true',
+                        help="use a tiny randomly initialized GPT-2 and a blank spaCy pipeline (offline, "
+                             "CPU only); its byte-level tokenizer needs a larger --max-length")
+    parser.add_argument('--corpus-sizes', type=int, nargs='+', default=[1, 4, 16],
+                        help="sentences per document for each 'stages' run")
+    parser.add_argument('--output', help="write 'stages' results to this JSON file instead of stdout")
+    parser.add_argument('--profile', choices=['cprofile', 'torch'])
+    parser.add_argument('--profile-output', default='benchmark.prof')
+    args = parser.parse_args()
+
+    humanizer_kwargs = {}
+    if args.tiny:
+        # Removed again when the interpreter exits
+        tiny_dir = tempfile.TemporaryDirectory(prefix='ai-humanizer-')
+        args.model, humanizer_kwargs['spacy_model'], args.draft_model = make_tiny_models(tiny_dir.name, draft=True)
+
+    humanizer = AIHumanizer(args.model, assistant_confidence_threshold=args.assistant_confidence_threshold,
+                            **humanizer_kwargs)
+    if args.spacy_full:
+        humanizer._nlp = spacy.load('en_core_web_sm')
+    if args.benchmark == 'stages':
+        results = bench_stages(humanizer, args.corpus_sizes, args.docs, args.new_tokens,
+                               args.profile, args.profile_output)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            print_stages(results)
+        else:
+            print(json.dumps(results, indent=2))
+    elif args.benchmark == 'pool':
+        bench_pool(args.model, make_corpus(args.docs), args.processes, args.max_length, **humanizer_kwargs)
+    elif args.benchmark == 'precision':
+        if not bench_precision(args.model, make_corpus(args.docs, seed=0), args.precisions,
+                               args.new_tokens, args.threads, args.min_agreement, **humanizer_kwargs):
+            raise SystemExit(1)
+    elif args.benchmark == 'batch':
+        bench_batch(humanizer, make_corpus(args.docs), args.batch_sizes, args.max_length)
+    elif args.benchmark == 'postprocess':
+        if not bench_post_process(humanizer, args.paragraphs, args.size_mb):
+            raise SystemExit(1)
+    elif args.benchmark == 'spacy':
+        bench_spacy(humanizer, make_corpus(args.docs), args.max_length)
+    elif args.benchmark == 'startup':
+        bench_startup(humanizer)
+    elif args.benchmark == 'assisted':
+        if not bench_assisted(humanizer, args.draft_model, make_corpus(args.docs), args.new_tokens, args.lookaheads):
+            raise SystemExit(1)
+    elif args.benchmark == 'prefix':
+        bench_prefix(humanizer, make_corpus(args.docs), args.new_tokens, args.auto_register_after)
+    elif args.benchmark == 'metrics':
+        bench_metrics(humanizer, make_corpus(args.docs), args.max_length)
+    elif args.benchmark == 'stream':
+        bench_stream(humanizer, make_corpus(args.docs), args.max_length)
+    elif args.benchmark == 'async':
+        bench_async(humanizer, make_corpus(args.docs), args.concurrency, args.max_length,
+                    args.max_wait_ms, args.max_batch_size)
@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+
+from ai_ import AIHumanizer
+from pool import HumanizerPool
+
+
+class CompletedBatch:
+    # What an in-process run hands back in place of pool.PendingBatch
+    def __init__(self, results):
+        self.results = results
+
+    def get(self, timeout=None):
+        return self.results
+
+
+class InlineRunner:
+    # submit_records() interface of HumanizerPool, running in this process
+    def __init__(self, humanizer, batch_size):
+        self.humanizer = humanizer
+        self.batch_size = batch_size
+
+    def submit_records(self, texts, max_length=150):
+        return CompletedBatch(self.humanizer.humanize_records(texts, self.batch_size, max_length))
+
+    def close(self):
+        pass
+
+
+def load_checkpoint(path, input_path, settings, output_path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint['input'] != os.path.abspath(input_path):
+        raise SystemExit(f"{path} belongs to a run over {checkpoint['input']}; use --restart to start over")
+    # Resuming with different settings would silently mix two kinds of output in one file
+    changed = sorted(name for name in settings if checkpoint.get('settings', {}).get(name) != settings[name])
+    if changed:
+        raise SystemExit(f"{path} was written with different {', '.join(changed)}; use --restart to start over")
+    output_size = os.path.getsize(output_path) if os.path.exists(output_path) else None
+    if checkpoint['output_offset'] and (output_size is None or output_size < checkpoint['output_offset']):
+        raise SystemExit(f"{output_path} is missing or shorter than {path} expects; use --restart to start over")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    # Write-then-rename, so a crash never leaves a half-written checkpoint behind
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def iter_batches(f, input_format, text_field, batch_size, line_number):
+    # Yields (records, texts, input offset after the batch, last line number) from a file
+    # opened in binary mode, reading one line at a time
+    records, texts = [], []
+    for line in iter(f.readline, b''):
+        line_number += 1
+        line = line.decode('utf-8').strip()
+        if not line:
+            continue
+        if input_format == 'jsonl':
+            try:
+                record = json.loads(line)
+                text = record[text_field]
+            except (ValueError, KeyError, TypeError) as e:
+                raise SystemExit(f"line {line_number}: not a JSON object with a {text_field!r} field ({e})")
+        else:
+            record, text = {text_field: line}, line
+        records.append(record)
+        texts.append(text)
+        if len(records) == batch_size:
+            yield records, texts, f.tell(), line_number
+            records, texts = [], []
+    if records:
+        yield records, texts, f.tell(), line_number
+
+
+class Progress:
+    def __init__(self, total_bytes, start_offset, records, interval):
+        self.total_bytes = total_bytes
+        self.start_offset = start_offset
+        self.records = records
+        self.session_records = 0
+        self.interval = interval
+        self.started = self.last_report = time.perf_counter()
+
+    def update(self, records, offset, force=False):
+        self.records += records
+        self.session_records += records
+        now = time.perf_counter()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+
+        elapsed = now - self.started
+        rate = self.session_records / elapsed if elapsed else 0.0
+        bytes_rate = (offset - self.start_offset) / elapsed if elapsed else 0.0
+        eta = (self.total_bytes - offset) / bytes_rate if bytes_rate else float('inf')
+        done = offset / self.total_bytes if self.total_bytes else 1.0
+        print(f"{self.records} records ({done:.1%}), {rate:.2f} records/s, "
+              f"ETA {format_duration(eta)}", file=sys.stderr, flush=True)
+
+
+def format_duration(seconds):
+    if seconds == float('inf'):
+        return '?'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def run(args):
+    input_format = args.format or ('jsonl' if args.input.endswith(('.jsonl', '.json')) else 'text')
+    checkpoint_path = args.output + '.checkpoint'
+    # Everything that shapes the output records
+    settings = {'model': args.model, 'precision': args.precision, 'draft_model': args.draft_model,
+                'format': input_format, 'text_field': args.text_field, 'output_field': args.output_field,
+                'error_field': args.error_field, 'max_length': args.max_length}
+    checkpoint = None if args.restart else load_checkpoint(checkpoint_path, args.input, settings, args.output)
+    if checkpoint is None:
+        checkpoint = {'input': os.path.abspath(args.input), 'settings': settings, 'input_offset': 0,
+                      'output_offset': 0, 'line': 0, 'records': 0, 'errors': 0}
+    else:
+        print(f"resuming after {checkpoint['records']} records (line {checkpoint['line']})", file=sys.stderr)
+
+    humanizer_kwargs = {'model_name': args.model, 'precision': args.precision, 'draft_model': args.draft_model}
+    if args.workers > 1:
+        # Workers split the cores between them, so each one defaults to a single thread
+        runner = HumanizerPool(processes=args.workers, threads_per_worker=args.threads or 1, **humanizer_kwargs)
+    else:
+        runner = InlineRunner(AIHumanizer(num_threads=args.threads, **humanizer_kwargs), args.batch_size)
+    # Enough batches in flight to keep every worker busy, and no more, so memory stays bounded
+    max_in_flight = 2 * args.workers
+
+    progress = Progress(os.path.getsize(args.input), checkpoint['input_offset'], checkpoint['records'],
+                        args.progress_every)
+    # Drop anything written after the last checkpoint; it will be produced again
+    mode = 'r+b' if checkpoint['output_offset'] else 'wb'
+    with open(args.input, 'rb') as f, open(args.output, mode) as out:
+        f.seek(checkpoint['input_offset'])
+        out.truncate(checkpoint['output_offset'])
+        out.seek(checkpoint['output_offset'])
+
+        def write(records, pending, input_offset, line_number):
+            errors = 0
+            for record, (humanized, error) in zip(records, pending.get()):
+                # A record that failed keeps its place in the output, with the reason
+                record[args.output_field] = humanized
+                if error is not None:
+                    record[args.error_field] = error
+                    errors += 1
+                out.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+            out.flush()
+            os.fsync(out.fileno())
+            checkpoint.update(input_offset=input_offset, output_offset=out.tell(), line=line_number,
+                              records=checkpoint['records'] + len(records),
+                              errors=checkpoint.get('errors', 0) + errors)
+            save_checkpoint(checkpoint_path, checkpoint)
+            progress.update(len(records), input_offset)
+
+        in_flight = deque()
+        batches = iter_batches(f, input_format, args.text_field, args.batch_size, checkpoint['line'])
+        for records, texts, input_offset, line_number in batches:
+            in_flight.append((records, runner.submit_records(texts, args.max_length), input_offset, line_number))
+            # Results are written strictly in input order so the checkpoint offsets stay valid
+            if len(in_flight) >= max_in_flight:
+                write(*in_flight.popleft())
+        while in_flight:
+            write(*in_flight.popleft())
+
+    runner.close()
+    progress.update(0, checkpoint['input_offset'], force=True)
+    if checkpoint.get('errors'):
+        print(f"{checkpoint['errors']} records failed; see the {args.error_field!r} field", file=sys.stderr)
+    os.remove(checkpoint_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Humanize a JSONL or plain-text corpus (one document per line) into a JSONL file. "
+                    "Interrupted runs resume from the last checkpoint."
+    )
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--format', choices=['jsonl', 'text'],
+                        help="input format (default: jsonl for .jsonl/.json files, text otherwise)")
+    parser.add_argument('--text-field', default='text')
+    parser.add_argument('--output-field', default='humanized')
+    parser.add_argument('--error-field', default='error', help="field that records why a record failed")
+    parser.add_argument('--model', default='gpt2-medium')
+    parser.add_argument('--draft-model', help="small model for assisted generation, e.g. distilgpt2")
+    parser.add_argument('--precision', choices=['fp32', 'bf16', 'int8'], default='fp32')
+    parser.add_argument('--max-length', type=int, default=150,
+                        help="prompt plus generated tokens; longer records are humanized chunk by chunk")
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=1, help="worker processes (1 runs in-process)")
+    parser.add_argument('--threads', type=int,
+                        help="torch threads per worker (default: 1 with --workers, torch's default otherwise)")
+    parser.add_argument('--progress-every', type=float, default=10, help="seconds between progress lines")
+    parser.add_argument('--restart', action='store_true', help="ignore an existing checkpoint and start over")
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import threading
+import time
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics:
+    # Latency histograms per stage plus plain counters (tokens, paragraphs, topic hits, ...)
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='ai_humanizer'):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = {
+                    'buckets': [0] * len(self.buckets),
+                    'sum': 0.0,
+                    'count': 0
+                }
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def as_dict(self):
+        with self._lock:
+            stages = {}
+            for stage, histogram in self._histograms.items():
+                cumulative, buckets = 0, {}
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    cumulative += count
+                    buckets[bound] = cumulative
+                stages[stage] = {
+                    'count': histogram['count'],
+                    'sum': histogram['sum'],
+                    'mean': histogram['sum'] / histogram['count'],
+                    'buckets': buckets
+                }
+            return {'stages': stages, 'counters': dict(self._counters)}
+
+    def to_prometheus(self):
+        # Prometheus text exposition format
+        snapshot = self.as_dict()
+        name = f'{self.prefix}_stage_seconds'
+        lines = [f'# HELP {name} Time spent in each humanize stage.', f'# TYPE {name} histogram']
+        for stage, histogram in sorted(snapshot['stages'].items()):
+            for bound, count in histogram['buckets'].items():
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram["count"]}')
+        for counter, value in sorted(snapshot['counters'].items()):
+            lines.append(f'# TYPE {self.prefix}_{counter}_total counter')
+            lines.append(f'{self.prefix}_{counter}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    # Times one stage and reports it, with any counts collected along the way, to the
+    # humanizer's metrics and hooks
+    enabled = True
+
+    def __init__(self, metrics, hooks, stage):
+        self.metrics = metrics
+        self.hooks = hooks
+        self.stage = stage
+        self.counts = {}
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        if self.metrics is not None:
+            self.metrics.observe(self.stage, seconds)
+            for name, value in self.counts.items():
+                self.metrics.increment(name, value)
+        for hook in self.hooks:
+            hook(self.stage, seconds, self.counts)
+
+
+class NullStage:
+    # Stand-in used when instrumentation is off; callers check `enabled` before counting
+    enabled = False
+
+    def count(self, name, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_STAGE = NullStage()
@@ -0,0 +1,141 @@
+import multiprocessing
+import os
+import resource
+import time
+
+import torch
+
+from ai_ import AIHumanizer
+
+# The humanizer the next pool forks from. Workers inherit it at fork time, so the
+# model weights loaded by the parent are shared copy-on-write instead of reloaded.
+_humanizer = None
+
+
+def memory_usage():
+    # Resident and private (unshared) memory of the current process, in bytes
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+        return {
+            'rss': fields['Rss'],
+            'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+        }
+    except (OSError, KeyError):
+        # Peak RSS is the best we can do without /proc
+        return {'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, 'private': None}
+
+
+def _init_worker(threads_per_worker):
+    # One process per core: keep torch from spawning competing intra-op threads
+    torch.set_num_threads(threads_per_worker)
+    torch.set_num_interop_threads(1)
+
+
+def _humanize(args):
+    text, max_length = args
+    start = time.perf_counter()
+    result = _humanizer.humanize_text(text, max_length)
+    return os.getpid(), time.perf_counter() - start, memory_usage(), result
+
+
+def _humanize_batch(args):
+    texts, max_length = args
+    start = time.perf_counter()
+    results = _humanizer.humanize_batch(texts, len(texts), max_length)
+    return os.getpid(), time.perf_counter() - start, memory_usage(), results
+
+
+def _humanize_records(args):
+    texts, max_length = args
+    start = time.perf_counter()
+    results = _humanizer.humanize_records(texts, len(texts), max_length)
+    return os.getpid(), time.perf_counter() - start, memory_usage(), results
+
+
+class PendingBatch:
+    # Handle for a batch submitted with HumanizerPool.submit_batch
+    def __init__(self, pool, async_result):
+        self._pool = pool
+        self._async_result = async_result
+
+    def ready(self):
+        return self._async_result.ready()
+
+    def get(self, timeout=None):
+        pid, elapsed, memory, results = self._async_result.get(timeout)
+        self._pool._record(pid, elapsed, memory, len(results))
+        return results
+
+
+class HumanizerPool:
+    def __init__(self, model_name='gpt2-medium', processes=None, threads_per_worker=1,
+                 share_memory=False, **humanizer_kwargs):
+        global _humanizer
+
+        self.humanizer = AIHumanizer(model_name, device='cpu', **humanizer_kwargs)
+        # Load (but do not run) everything in the parent, before forking. Running torch
+        # ops here would start the parent's OpenMP pool, which does not survive fork.
+        self.humanizer.load()
+        if share_memory:
+            self.humanizer.model.share_memory()
+
+        self.processes = processes or max(1, (os.cpu_count() or 1) // threads_per_worker)
+        self.worker_stats = {}
+        self._started = time.perf_counter()
+
+        _humanizer = self.humanizer
+        context = multiprocessing.get_context('fork')
+        self._pool = context.Pool(self.processes, initializer=_init_worker, initargs=(threads_per_worker,))
+
+    def humanize_text(self, ai_text, max_length=150):
+        return self.humanize_texts([ai_text], max_length)[0]
+
+    def humanize_texts(self, texts, max_length=150):
+        results = []
+        for pid, elapsed, memory, result in self._pool.imap(_humanize, ((text, max_length) for text in texts)):
+            self._record(pid, elapsed, memory)
+            results.append(result)
+        return results
+
+    def submit_batch(self, texts, max_length=150):
+        # Runs one humanize_batch call on a worker without blocking; see PendingBatch
+        return PendingBatch(self, self._pool.apply_async(_humanize_batch, ((list(texts), max_length),)))
+
+    def submit_records(self, texts, max_length=150):
+        # submit_batch for humanize_records: per-text (result, error) pairs, never raising
+        return PendingBatch(self, self._pool.apply_async(_humanize_records, ((list(texts), max_length),)))
+
+    def _record(self, pid, elapsed, memory, requests=1):
+        stats = self.worker_stats.setdefault(pid, {'requests': 0, 'busy_time': 0.0})
+        stats['requests'] += requests
+        stats['busy_time'] += elapsed
+        stats.update(memory)
+
+    def stats(self):
+        # Per-worker throughput (requests per busy second) and latest memory usage
+        wall_time = time.perf_counter() - self._started
+        workers = {
+            pid: dict(stats, throughput=stats['requests'] / stats['busy_time'] if stats['busy_time'] else 0.0)
+            for pid, stats in self.worker_stats.items()
+        }
+        total = sum(stats['requests'] for stats in self.worker_stats.values())
+        return {'workers': workers, 'requests': total, 'throughput': total / wall_time, 'parent': memory_usage()}
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
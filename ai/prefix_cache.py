@@ -0,0 +1,146 @@
+import copy
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import torch
+
+
+class PrefixCache:
+    # LRU cache of GPT-2 past_key_values for prompt prefixes shared between requests, such
+    # as a fixed style instruction or document header. Prefixes are matched on token ids,
+    # so a registered prefix should end on a natural token boundary (a newline is safest).
+    #
+    # With auto_register_after=N, any block-aligned prefix (multiples of block_tokens)
+    # seen in N requests is registered automatically.
+    #
+    # Entries belong to the model object that computed them, so one cache can be shared
+    # by humanizers with different models or precisions without mixing them up.
+    def __init__(self, max_bytes=256 * 2**20, auto_register_after=None, block_tokens=32, max_candidates=4096):
+        self.max_bytes = max_bytes
+        self.auto_register_after = auto_register_after
+        self.block_tokens = block_tokens
+        self.max_candidates = max_candidates
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.tokens_saved = 0
+        self.prefill_seconds_saved = 0.0
+        # (model key, prefix ids) -> (past_key_values, size in bytes, prefill seconds)
+        self._entries = OrderedDict()
+        self._candidates = OrderedDict()
+        # model key -> finalizer that drops the model's entries when it is garbage collected
+        self._models = {}
+        self._lock = threading.RLock()
+
+    def register(self, model, prefix_ids):
+        prefix_ids = tuple(prefix_ids)
+        key = (self._model_key(model), prefix_ids)
+        with self._lock:
+            if key in self._entries:
+                return
+
+        input_ids = torch.tensor([prefix_ids], device=model.device)
+        start = time.perf_counter()
+        with torch.inference_mode():
+            past_key_values = model(input_ids, use_cache=True).past_key_values
+        prefill_seconds = time.perf_counter() - start
+
+        # Keys and values for every layer and prefix position
+        config = model.config
+        size = 2 * config.n_layer * len(prefix_ids) * config.n_embd * next(model.parameters()).element_size()
+
+        with self._lock:
+            self._entries[key] = (past_key_values, size, prefill_seconds)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+
+    def lookup(self, model, input_ids):
+        # A private copy of the cache for the longest registered prefix of input_ids, or None.
+        # generate() extends the cache in place, so the stored one must never be handed out.
+        input_ids = tuple(input_ids)
+        model_key = self._model_key(model)
+        if self.auto_register_after:
+            self._count_candidates(model, model_key, input_ids)
+
+        with self._lock:
+            best = None
+            for key in self._entries:
+                owner, prefix_ids = key
+                if owner != model_key:
+                    continue
+                # At least one token has to be left for generate() to process
+                if len(prefix_ids) < len(input_ids) and input_ids[:len(prefix_ids)] == prefix_ids:
+                    if best is None or len(prefix_ids) > len(best[1]):
+                        best = key
+            if best is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best)
+            past_key_values, _, prefill_seconds = self._entries[best]
+            self.hits += 1
+            self.tokens_saved += len(best[1])
+            self.prefill_seconds_saved += prefill_seconds
+            return copy.deepcopy(past_key_values)
+
+    def _model_key(self, model):
+        # id() is only unique while the model is alive, so its entries are dropped with it
+        model_key = id(model)
+        with self._lock:
+            if model_key not in self._models:
+                self._models[model_key] = weakref.finalize(model, self._forget_model, model_key)
+        return model_key
+
+    def _forget_model(self, model_key):
+        with self._lock:
+            self._models.pop(model_key, None)
+            for key in [key for key in self._entries if key[0] == model_key]:
+                _, size, _ = self._entries.pop(key)
+                self.bytes -= size
+            for key in [key for key in self._candidates if key[0] == model_key]:
+                del self._candidates[key]
+
+    def _count_candidates(self, model, model_key, input_ids):
+        ready = None
+        with self._lock:
+            for length in range(self.block_tokens, len(input_ids), self.block_tokens):
+                key = (model_key, input_ids[:length])
+                if key in self._entries:
+                    continue
+                seen = self._candidates.pop(key, 0) + 1
+                self._candidates[key] = seen
+                if seen >= self.auto_register_after:
+                    ready = key
+            while len(self._candidates) > self.max_candidates:
+                self._candidates.popitem(last=False)
+            if ready is not None:
+                del self._candidates[ready]
+        # Register the longest prefix that just became frequent
+        if ready is not None:
+            self.register(model, ready[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._candidates.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'tokens_saved': self.tokens_saved,
+                'prefill_seconds_saved': self.prefill_seconds_saved
+            }